@@ -0,0 +1,87 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Measures the memory used per :class:`twistit.Event`.
+
+Usage::
+
+    python benchmarks/event_memory.py [count]
+
+Uses `tracemalloc` where available (Python 3). Otherwise the size
+is estimated with `sys.getsizeof` of the event and the containers
+it owns.
+"""
+
+import sys
+import twistit
+
+def callback(value):
+    pass
+
+def idle():
+    return twistit.Event()
+
+def one_callback():
+    event = twistit.Event()
+    event.add_callback(callback)
+    return event
+
+def two_callbacks():
+    event = twistit.Event()
+    event.add_callback(callback)
+    event.add_callback(callback)
+    return event
+
+def measure_tracemalloc(factory, count):
+    import tracemalloc
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    events = [factory() for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    # Don't count the list holding the events.
+    total -= sys.getsizeof(events)
+    return float(total) / count
+
+def measure_getsizeof(factory, count):
+    event = factory()
+    total = sys.getsizeof(event)
+    for name in ("_callbacks", "_subscriptions", "_waiters"):
+        value = getattr(event, name)
+        if value is not None:
+            total += sys.getsizeof(value)
+    return float(total)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    try:
+        import tracemalloc
+        measure = measure_tracemalloc
+    except ImportError:
+        measure = measure_getsizeof
+    
+    for factory in (idle, one_callback, two_callbacks):
+        print("%-15s %8.1f bytes per event" % 
+              (factory.__name__, measure(factory, count)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Compares the cost of :func:`twistit.timeout_deferred` with timeouts 
+scheduled on the reactor and on a :class:`twistit.TimerWheel`, and 
+of :meth:`twistit.TimeoutGroup.timeout_deferred`.
+
+Keeps a given number of timeouts pending. Each step arms a new one and
+resolves the oldest before it is due, as is the common case. The reactor
+moves new delayed calls into its heap while it runs, so we let it do that 
+every hundred steps.
+
+Usage::
+
+    python benchmarks/timeout_timers.py [pending] [steps]
+"""
+
+import collections
+import sys
+import timeit
+
+from twisted.internet import defer, reactor
+import twistit
+
+def run(pending, steps, timeout):
+    deferreds = collections.deque()
+    for _ in range(pending):
+        deferreds.append(timeout(defer.Deferred()))
+    reactor.runUntilCurrent()
+    
+    def loop():
+        for i in range(steps):
+            deferreds.append(timeout(defer.Deferred()))
+            deferreds.popleft().callback(None)
+            if i % 100 == 0:
+                reactor.runUntilCurrent()
+    seconds = timeit.timeit(loop, number=1)
+    delayed_calls = len(reactor.getDelayedCalls())
+    
+    while deferreds:
+        deferreds.popleft().callback(None)
+    reactor.runUntilCurrent()
+    return seconds, delayed_calls
+        
+def run_timers(pending, steps, clock):
+    calls = collections.deque()
+    for _ in range(pending):
+        calls.append(clock.callLater(60, lambda: None))
+    reactor.runUntilCurrent()
+    
+    def loop():
+        for i in range(steps):
+            calls.append(clock.callLater(60, lambda: None))
+            calls.popleft().cancel()
+            if i % 100 == 0:
+                reactor.runUntilCurrent()
+    seconds = timeit.timeit(loop, number=1)
+    
+    while calls:
+        calls.popleft().cancel()
+    reactor.runUntilCurrent()
+    return seconds
+        
+def main():
+    pending = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    
+    wheel = twistit.TimerWheel(tick=0.1, slots=1024)
+    group = twistit.TimeoutGroup(tolerance=0.1)
+    
+    for name, clock in [("callLater", reactor), ("TimerWheel", wheel)]:
+        seconds = min(run_timers(pending, steps, clock) for _ in range(3))
+        print("%-16s %-12s %8.3f us per step" % 
+              ("arm and cancel", name, seconds * 1e6 / steps))
+        
+    timeouts = [("callLater", lambda d: twistit.timeout_deferred(d, 60)),
+                ("TimerWheel", lambda d: twistit.timeout_deferred(d, 60, 
+                                                                  clock=wheel)),
+                ("TimeoutGroup", lambda d: group.timeout_deferred(d, 60))]
+    for name, timeout in timeouts:
+        seconds, delayed_calls = min(run(pending, steps, timeout) 
+                                     for _ in range(3))
+        print("%-16s %-12s %8.3f us per step %8d delayed calls" % 
+              ("timeout_deferred", name, seconds * 1e6 / steps, delayed_calls))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Compares the cost per `yield` and per invocation of
+:func:`twistit.yieldefer` with :func:`defer.inlineCallbacks`.
+
+Usage::
+
+    python benchmarks/yieldefer_steps.py [steps]
+"""
+
+import sys
+import timeit
+
+from twisted.internet import defer
+import twistit
+
+def plain_values(steps):
+    for i in range(steps):
+        yield i
+
+def fired_deferreds(steps):
+    for i in range(steps):
+        yield defer.succeed(i)
+        
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    
+    decorators = [("yieldefer", twistit.yieldefer), 
+                  ("inlineCallbacks", defer.inlineCallbacks)]
+    generators = [plain_values, fired_deferreds]
+    
+    for generator in generators:
+        for name, decorator in decorators:
+            function = decorator(generator)
+            seconds = min(timeit.repeat(lambda: function(steps), 
+                                        number=1, repeat=5))
+            print("%-16s %-16s %8.3f us per step" % 
+                  (generator.__name__, name, seconds * 1e6 / steps))
+            
+    for name, decorator in decorators:
+        function = decorator(fired_deferreds)
+        def invocations():
+            for _ in range(steps):
+                function(1)
+        seconds = min(timeit.repeat(invocations, number=1, repeat=5))
+        print("%-16s %-16s %8.3f us per invocation" % 
+              ("single_step", name, seconds * 1e6 / steps))
+
+if __name__ == "__main__":
+    main()
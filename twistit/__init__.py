@@ -18,9 +18,16 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-from twistit._events import Event
-from twistit._yieldefer import yieldefer
-from twistit._timeout import timeout_deferred, TimeoutError
+from twistit._events import Event, Subscription, ObserverStats
+from twistit._yieldefer import yieldefer, yieldstream, emit, Stream, EndOfStream
+from twistit._yieldefer import enable_profiling, disable_profiling, get_profile, CoroutineProfile
+from twistit._concurrency import gather, race, bounded_map
+from twistit._memoize import memoize
+from twistit._retry import retry, RetryBudget
+from twistit._timeout import timeout_deferred, TimeoutError, Deadline, TimeoutGroup
+from twistit._timeout import AdaptiveTimeout
+from twistit._sketch import QuantileSketch
+from twistit._timerwheel import TimerWheel
 from twistit._errorhandling import on_error_close
 from twistit._testing import has_result, extract, extract_failure, NotCalledError
 from twistit._mock import TimeMock
@@ -0,0 +1,170 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Run several deferred operations at once and cancel the ones
+that are no longer needed.
+
+All functions attach callbacks to the deferreds they get, 
+failures are consumed. Cancelling the returned deferred cancels
+all operations that are still running. Together with 
+:func:`~twistit.yieldefer` the cancellation reaches whatever the 
+coroutines are waiting for.
+"""
+
+from twisted.internet import defer
+from twisted.python import failure
+
+def gather(deferreds):
+    """
+    Returns a deferred that calls back with a list of the results of 
+    the given deferreds, in the same order.
+    
+    If one of them fails, the others are cancelled and the returned
+    deferred fails with that failure.
+    """
+    deferreds = list(deferreds)
+    results = [None] * len(deferreds)
+    remaining = [len(deferreds)]
+    
+    def cancel_all(_=None):
+        for d in deferreds:
+            d.cancel()
+    result = defer.Deferred(cancel_all)
+    
+    def succeeded(value, index):
+        results[index] = value
+        remaining[0] -= 1
+        if remaining[0] == 0 and not result.called:
+            result.callback(results)
+            
+    def failed(failure):
+        if not result.called:
+            result.errback(failure)
+            cancel_all()
+            
+    if not deferreds:
+        result.callback(results)
+    for index, d in enumerate(deferreds):
+        d.addCallbacks(succeeded, failed, callbackArgs=(index,))
+    return result
+
+def race(deferreds):
+    """
+    Returns a deferred with the result of the first of the given
+    deferreds that gets one, be it a value or a failure. The other
+    deferreds are cancelled.
+    """
+    deferreds = list(deferreds)
+    if not deferreds:
+        raise ValueError("Cannot race without deferreds.")
+    
+    def cancel_all(_=None):
+        for d in deferreds:
+            d.cancel()
+    result = defer.Deferred(cancel_all)
+    
+    def got_result(value):
+        if not result.called:
+            if isinstance(value, failure.Failure):
+                result.errback(value)
+            else:
+                result.callback(value)
+            cancel_all()
+            
+    for d in deferreds:
+        d.addBoth(got_result)
+    return result
+
+def bounded_map(function, iterable, concurrency):
+    """
+    Invokes `function` for each item in `iterable`, with at most 
+    `concurrency` of the returned deferreds still waiting for their
+    result at any time. 
+    
+    Returns a deferred that calls back with the list of the results,
+    in the order of the items. If one of them fails, no more items are 
+    taken, those that are still running are cancelled and the returned 
+    deferred fails with that failure.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least one.")
+    
+    items = iter(iterable)
+    results = []
+    
+    #: Maps the index of the items to the deferreds still running.
+    running = {}
+    
+    #: `exhausted[0]` is True once all items have been taken. 
+    #: `busy[0]` is True while `start` is taking items.
+    exhausted = [False]
+    busy = [False]
+    
+    def cancel_all(_=None):
+        for d in list(running.values()):
+            d.cancel()
+    result = defer.Deferred(cancel_all)
+    
+    def start():
+        # Operations that complete immediately would otherwise
+        # invoke `start` recursively.
+        if busy[0]:
+            return
+        busy[0] = True
+        try:
+            while len(running) < concurrency and not exhausted[0]:
+                if result.called:
+                    return
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted[0] = True
+                    break
+                index = len(results)
+                results.append(None)
+                d = defer.maybeDeferred(function, item)
+                running[index] = d
+                d.addCallbacks(succeeded, failed, 
+                               callbackArgs=(index,), errbackArgs=(index,))
+        except:
+            if not result.called:
+                result.errback()
+                cancel_all()
+            return
+        finally:
+            busy[0] = False
+        
+        if exhausted[0] and not running and not result.called:
+            result.callback(results)
+    
+    def succeeded(value, index):
+        del running[index]
+        results[index] = value
+        start()
+        
+    def failed(failure, index):
+        del running[index]
+        if not result.called:
+            result.errback(failure)
+            cancel_all()
+            
+    start()
+    return result
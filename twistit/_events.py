@@ -18,7 +18,67 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import collections
+import weakref
+import logging
+import timeit
+
 from twisted.internet import defer
+from twisted.python import failure
+logger = logging.getLogger(__name__)
+
+class Subscription(object):
+    """
+    Handle for a callback registered with :meth:`Event.add_callback`.
+    
+    Passing it to :meth:`Event.remove_callback` unregisters exactly this
+    registration without having to search for the callback.
+    """
+    
+    __slots__ = ["_callback", "_dispatch", "batch", "weak"]
+    
+    def __init__(self, callback, batch=False, weak=False):
+        if weak:
+            callback = _weak_reference(callback)
+        self._callback = callback
+        self._dispatch = None
+        self.batch = batch
+        self.weak = weak
+        
+    @property
+    def callback(self):
+        """
+        The registered callback. For weak subscriptions this
+        is `None` once the callback has been garbage collected.
+        """
+        if self.weak:
+            return self._callback()
+        else:
+            return self._callback
+        
+    def __repr__(self):
+        return "Subscription(%r)" % (self.callback,)
+    
+def _weak_reference(callback):
+    """
+    Returns a function that returns `callback` or `None` once
+    it has been garbage collected. 
+    
+    A bound method only lives as long as someone holds it. Instead
+    we reference the instance it is bound to and bind it again.
+    """
+    instance = getattr(callback, "__self__", None)
+    function = getattr(callback, "__func__", None)
+    if instance is None or function is None:
+        return weakref.ref(callback)
+    
+    instance_ref = weakref.ref(instance)
+    def reference():
+        instance = instance_ref()
+        if instance is None:
+            return None
+        return function.__get__(instance, type(instance))
+    return reference
 
 class Event(object):
     """
@@ -33,46 +93,399 @@ class Event(object):
     
     """
     
+    __slots__ = ["_callbacks", "_subscriptions", "_snapshot", "_waiters",
+                 "_stats", "__weakref__"]
+    
     def __init__(self):
-        self._callbacks = []
+        # Events are often created in large numbers and many are never
+        # observed. Nothing is allocated until it is needed.
+        
+        #: `None` if there are no callbacks. The :class:`Subscription` 
+        #: if there is just one. Otherwise an ordered dict that maps
+        #: :class:`Subscription` to the function invoked by :meth:`fire`,
+        #: in the order the callbacks were registered.
+        self._callbacks = None
+        
+        #: Maps each callback to the list of its subscriptions. A callback
+        #: registered more than once has more than one subscription.
+        #: Only used together with the ordered dict in `_callbacks`.
+        self._subscriptions = None
+        
+        #: Tuple of the callbacks to invoke on :meth:`fire`. It is rebuilt
+        #: lazily after the registrations have changed, so that firing
+        #: doesn't have to copy anything and observers may still
+        #: register or unregister while the event fires.
+        self._snapshot = ()
+        
+        #: `None` or ordered dict with the deferreds returned by 
+        #: :meth:`next_event` that wait for the next call to :meth:`fire`.
+        self._waiters = None
+        
+        #: `None` or :class:`_Instrumentation` if :meth:`enable_stats`
+        #: was called.
+        self._stats = None
     
-    def add_callback(self, callback):
+    def add_callback(self, callback, weak=False):
         """
         Registers a callback that will be invoked on
         future calls to :meth:`fire`. The `callback` should
         take a single argument, the value passed to `fire`.
+        
+        If `weak` is `True` the event only holds a weak reference
+        to the callback, or to the instance if it is a bound method.
+        The registration is dropped once the callback has been
+        garbage collected.
+        
+        Returns a :class:`Subscription` which can be passed to
+        :meth:`remove_callback`.
+        """
+        return self._add(Subscription(callback, weak=weak))
+    
+    def add_batch_callback(self, callback, weak=False):
+        """
+        Registers a callback that takes a list of values instead
+        of a single one. :meth:`fire_many` invokes it only once with
+        all values, :meth:`fire` invokes it with a list containing
+        just the fired value.
+        
+        See :meth:`add_callback` for `weak`.
+        
+        Returns a :class:`Subscription` which can be passed to
+        :meth:`remove_callback`.
+        """
+        return self._add(Subscription(callback, batch=True, weak=weak))
+        
+    def _add(self, subscription):
+        """
+        Registers `subscription`.
+        """
+        subscription._dispatch = self._dispatcher(subscription)
+        callbacks = self._callbacks
+        if callbacks is None:
+            self._callbacks = subscription
+        else:
+            if isinstance(callbacks, Subscription):
+                self._callbacks = collections.OrderedDict()
+                self._subscriptions = {}
+                self._register(callbacks)
+            self._register(subscription)
+        self._snapshot = None
+        self._observed()
+        return subscription
+    
+    def _register(self, subscription):
         """
-        self._callbacks.append(callback)
+        Adds `subscription` to the ordered dict in `_callbacks`.
+        """
+        self._callbacks[subscription] = subscription._dispatch
+        if not subscription.weak:
+            callback = subscription.callback
+            try:
+                self._subscriptions.setdefault(callback, []).append(subscription)
+            except TypeError:
+                # Unhashable callbacks, such as `list.append`, are not indexed.
+                # Removing them by value requires a scan.
+                pass
+    
+    def _dispatcher(self, subscription):
+        """
+        Returns the function :meth:`fire` invokes with the value.
+        """
+        if subscription.weak:
+            reference = subscription._callback
+            batch = subscription.batch
+            def dispatch(value):
+                callback = reference()
+                if callback is None:
+                    self._discard(subscription)
+                elif batch:
+                    return callback([value])
+                else:
+                    return callback(value)
+            return dispatch
+        
+        callback = subscription.callback
+        if subscription.batch:
+            return lambda value: callback([value])
+        else:
+            return callback
+        
+    def _discard(self, subscription):
+        """
+        Removes a weak subscription whose callback has been garbage 
+        collected, unless that already happened.
+        """
+        if self._registered(subscription):
+            self.remove_callback(subscription)
     
     def remove_callback(self, callback):
         """
         Unregisters a previously registered callback.
         Future calls to :meth:`fire` will no longer invoke it.
+        
+        `callback` is either the :class:`Subscription` returned by
+        :meth:`add_callback` or the callback itself. If a callback
+        was registered several times, only the oldest registration
+        is removed. Raises `ValueError` if it isn't registered.
         """
-        self._callbacks.remove(callback)
+        if isinstance(callback, Subscription):
+            subscription = callback
+            if not self._registered(subscription):
+                raise ValueError("Not registered: %r" % subscription)
+        else:
+            subscription = self._find(callback)
+        
+        self._snapshot = None
+        callbacks = self._callbacks
+        if callbacks is subscription:
+            self._callbacks = None
+            return
+        
+        del callbacks[subscription]
+        if not callbacks:
+            self._callbacks = None
+            self._subscriptions = None
+            return
+        
+        if subscription.weak:
+            return
+        try:
+            subscriptions = self._subscriptions[subscription.callback]
+        except TypeError:
+            return
+        subscriptions.remove(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.callback]
+        
+    def _registered(self, subscription):
+        """
+        Returns if `subscription` is registered.
+        """
+        callbacks = self._callbacks
+        if callbacks is subscription:
+            return True
+        elif isinstance(callbacks, collections.OrderedDict):
+            return subscription in callbacks
+        else:
+            return False
+        
+    def _registrations(self):
+        """
+        Returns a tuple with all subscriptions in the order
+        they were registered.
+        """
+        callbacks = self._callbacks
+        if callbacks is None:
+            return ()
+        elif isinstance(callbacks, Subscription):
+            return (callbacks,)
+        else:
+            return tuple(callbacks)
+        
+    def _build_snapshot(self):
+        """
+        Rebuilds and returns `_snapshot`.
+        """
+        callbacks = self._callbacks
+        if self._stats is not None:
+            snapshot = tuple(self._stats.wrap(subscription) 
+                             for subscription in self._registrations())
+        elif callbacks is None:
+            snapshot = ()
+        elif isinstance(callbacks, Subscription):
+            snapshot = (callbacks._dispatch,)
+        else:
+            snapshot = tuple(callbacks.values())
+        self._snapshot = snapshot
+        return snapshot
+        
+    def _find(self, callback):
+        """
+        Returns the oldest subscription of the given callback.
+        """
+        subscriptions = None
+        if self._subscriptions is not None:
+            try:
+                subscriptions = self._subscriptions.get(callback)
+            except TypeError:
+                pass
+        if not subscriptions:
+            # Unhashable and weak callbacks are not indexed.
+            subscriptions = [subscription 
+                             for subscription in self._registrations()
+                             if subscription.callback == callback]
+        if not subscriptions:
+            raise ValueError("Not registered: %r" % callback)
+        return subscriptions[0]
         
     def next_event(self, canceller=None):
         """
         Returns a :class:`~defer.Deferred` that will be called back
         with the value of the next event.
         """
-        d = defer.Deferred(canceller)
-        
-        def cb(value):
-            self.remove_callback(d.callback)
-            return value
-        d.addBoth(cb)
+        def cancel(d):
+            if self._waiters:
+                self._waiters.pop(d, None)
+            if canceller is not None:
+                canceller(d)
         
-        self.add_callback(d.callback)
+        d = defer.Deferred(cancel)
+        if self._waiters is None:
+            self._waiters = collections.OrderedDict()
+        self._waiters[d] = None
+        self._observed()
         return d
     
     def fire(self, value):
         """
         Invoke all registered callbacks and pass the given
         value as the argument.
+        
+        Callbacks registered or unregistered while the event fires
+        only take effect for the next call. The deferreds returned by
+        :meth:`next_event` are called after the callbacks.
+        """
+        waiters = self._take_waiters()
+        callbacks = self._snapshot
+        if callbacks is None:
+            callbacks = self._build_snapshot()
+        try:
+            for callback in callbacks:
+                callback(value)
+        finally:
+            for d in waiters:
+                # Might have been cancelled by one of the callbacks.
+                if not d.called:
+                    d.callback(value)
+    
+    def fire_async(self, value):
+        """
+        Like :meth:`fire`, but returns a :class:`~defer.Deferred` that
+        calls back with `None` once all deferreds returned by the callbacks
+        have been called. If one of them fails, the returned deferred fails 
+        with the first failure, but only after all have been called.
+        
+        A callback that raises an exception is handled the same way. As
+        with :meth:`fire`, the callbacks after it are not invoked.
+        """
+        waiters = self._take_waiters()
+        callbacks = self._snapshot
+        if callbacks is None:
+            callbacks = self._build_snapshot()
+        pending = []
+        try:
+            for callback in callbacks:
+                result = callback(value)
+                if isinstance(result, defer.Deferred):
+                    pending.append(result)
+        except:
+            pending.append(defer.fail())
+        finally:
+            for d in waiters:
+                if not d.called:
+                    d.callback(value)
+                    
+        if not pending:
+            return defer.succeed(None)
+        
+        def completed(results):
+            for success, result in results:
+                if not success:
+                    return result
+            return None
+        d = defer.DeferredList(pending, consumeErrors=True)
+        d.addCallback(completed)
+        return d
+    
+    def bounded_fire(self, max_in_flight):
+        """
+        Returns a function that takes a value and fires it with
+        :meth:`fire_async`, while keeping at most `max_in_flight` 
+        of those calls unfinished. 
+        
+        The function returns a :class:`~defer.Deferred` that calls 
+        back once the value has been fired. A producer that waits for
+        it before producing the next value slows down to the rate
+        of the observers.
+        
+        Since nobody waits for the calls to finish, failures
+        are logged.
+        """
+        semaphore = defer.DeferredSemaphore(max_in_flight)
+        
+        def finished(result):
+            semaphore.release()
+            if isinstance(result, failure.Failure):
+                logger.error("Event observer failed: %s" % 
+                             result.getTraceback())
+        
+        def dispatch(_, value):
+            try:
+                d = self.fire_async(value)
+            except:
+                semaphore.release()
+                raise
+            d.addBoth(finished)
+        
+        def fire(value):
+            d = semaphore.acquire()
+            d.addCallback(dispatch, value)
+            return d
+        return fire
+        
+    def fire_many(self, values):
+        """
+        Fires the event once for each of the given values.
+        
+        Each callback is invoked with all values before the
+        next callback is invoked. Callbacks registered with
+        :meth:`add_batch_callback` are invoked only once and get 
+        passed a list of all values. The deferreds returned by 
+        :meth:`next_event` are called with the first value.
+        """
+        values = list(values)
+        if not values:
+            return
+        
+        waiters = self._take_waiters()
+        subscriptions = self._registrations()
+        stats = self._stats
+        try:
+            for subscription in subscriptions:
+                if stats is None:
+                    self._dispatch_many(subscription, values)
+                else:
+                    stats.measure(subscription, self._dispatch_many, 
+                                  subscription, values)
+        finally:
+            for d in waiters:
+                if not d.called:
+                    d.callback(values[0])
+                    
+    def _dispatch_many(self, subscription, values):
+        """
+        Invokes the callback of `subscription` with all values.
+        """
+        callback = subscription.callback
+        if callback is None:
+            self._discard(subscription)
+        elif subscription.batch:
+            callback(values)
+        else:
+            for value in values:
+                callback(value)
+                    
+    def _take_waiters(self):
+        """
+        Returns the deferreds waiting for the next event and
+        starts a new queue for the waiters that are added while
+        the event fires.
         """
-        for callback in self._callbacks[:]:
-            callback(value)
+        waiters = self._waiters
+        if not waiters:
+            return ()
+        self._waiters = None
+        return waiters
     
     def derive(self, modifier):
         """
@@ -80,12 +493,323 @@ class Event(object):
         when this event fires. The value passed to the callbacks
         to the new event is the return value of the given
         `modifier` function which is passed the original value.
+        
+        The derived event only observes this event while it has
+        observers of its own. Deriving from a derived event that
+        has no observers does not create an intermediate step, the 
+        modifiers are applied one after the other instead. Hence
+        `modifier` should not have side effects.
+        """
+        return self._derive(modifier)
+    
+    def map(self, function):
+        """
+        Same as :meth:`derive`.
+        """
+        return self._derive(function)
+    
+    def filter(self, predicate):
+        """
+        Returns a new :class:`Event` instance that fires with
+        the values of this event for which `predicate` returns `True`.
+        
+        See :meth:`derive` about how derived events observe this event.
+        """
+        def stage(value):
+            return value if predicate(value) else _DROP
+        return self._derive(stage)
+    
+    def enable_stats(self, budget=None, timer=None):
+        """
+        Starts to record, for each callback, how often it was invoked,
+        how long it took and how often it raised an exception. 
+        
+        If `budget` is given, callbacks that take longer than `budget` 
+        seconds are logged as warnings. `timer` is a function that returns
+        the time in seconds, by default :func:`timeit.default_timer`.
+        
+        Events without stats enabled don't pay for this feature.
+        """
+        self._stats = _Instrumentation(budget, timer)
+        self._snapshot = None
+        
+    def disable_stats(self):
+        """
+        Stops recording and discards the recorded stats.
         """
-        def forward(value):
-            changed_value = modifier(value)
-            derived.fire(changed_value)
+        self._stats = None
+        self._snapshot = None
         
-        derived = Event()
-        self.add_callback(forward)
-        return derived
+    def get_stats(self):
+        """
+        Returns a list of :class:`ObserverStats`, one for each callback
+        that was invoked since :meth:`enable_stats`, including those 
+        that have been unregistered since. Returns an empty list if 
+        stats are not enabled.
+        """
+        if self._stats is None:
+            return []
+        return self._stats.snapshot()
+    
+    def coalesce(self, clock=None):
+        """
+        Returns a new :class:`Event` instance that fires at most
+        once per reactor iteration, with the latest value this event
+        fired with during that iteration.
+        
+        `clock` provides `IReactorTime` and defaults to the reactor.
+        See :meth:`derive` about how derived events observe this event.
+        """
+        return self._timed(_Coalesce, 0, clock)
+    
+    def throttle(self, interval, clock=None):
+        """
+        Returns a new :class:`Event` instance that fires at most
+        once every `interval` seconds. 
+        
+        The first value is passed on immediately. Values that arrive 
+        within `interval` seconds are dropped, except for the last one
+        which is passed on once the interval is over.
+        
+        `clock` provides `IReactorTime` and defaults to the reactor.
+        See :meth:`derive` about how derived events observe this event.
+        """
+        return self._timed(_Throttle, interval, clock)
+    
+    def debounce(self, interval, clock=None):
+        """
+        Returns a new :class:`Event` instance that fires with the 
+        latest value of this event once this event hasn't fired 
+        for `interval` seconds.
+        
+        `clock` provides `IReactorTime` and defaults to the reactor.
+        See :meth:`derive` about how derived events observe this event.
+        """
+        return self._timed(_Debounce, interval, clock)
+    
+    def _observed(self):
+        """
+        Invoked when a callback or waiter has been added.
+        """
+        
+    def _derive(self, stage):
+        """
+        Returns a derived event that applies the given stage. A stage
+        is a function that returns the modified value or `_DROP`.
+        """
+        return _DerivedEvent(self, (stage,))
+    
+    def _timed(self, cls, interval, clock):
+        """
+        Returns a derived event of the given :class:`_TimedEvent` subclass.
+        """
+        return cls(self, (), interval, clock)
+    
+#: Stats of a callback as returned by :meth:`Event.get_stats`.
+#: Times are in seconds.
+ObserverStats = collections.namedtuple("ObserverStats", 
+    ["callback", "calls", "errors", "total_time", "max_time"])
+
+class _Instrumentation(object):
+    """
+    Stats recorded by an :class:`Event` after :meth:`Event.enable_stats`.
+    """
+    
+    def __init__(self, budget, timer):
+        self.budget = budget
+        self.timer = timer if timer is not None else timeit.default_timer
+        
+        #: Maps :class:`Subscription` to the list 
+        #: `[calls, errors, total_time, max_time]`.
+        self.records = collections.OrderedDict()
+        
+    def wrap(self, subscription):
+        """
+        Returns a function that invokes the dispatch function
+        of `subscription` and records the stats.
+        """
+        dispatch = subscription._dispatch
+        def instrumented(value):
+            return self.measure(subscription, dispatch, value)
+        return instrumented
+    
+    def measure(self, subscription, function, *args):
+        """
+        Invokes `function` and records the stats for `subscription`.
+        """
+        record = self.records.get(subscription)
+        if record is None:
+            record = self.records[subscription] = [0, 0, 0.0, 0.0]
+        start = self.timer()
+        try:
+            return function(*args)
+        except:
+            record[1] += 1
+            raise
+        finally:
+            elapsed = self.timer() - start
+            record[0] += 1
+            record[2] += elapsed
+            record[3] = max(record[3], elapsed)
+            if self.budget is not None and elapsed > self.budget:
+                logger.warning("Event observer %r took %s seconds, "
+                               "the budget is %s seconds." % 
+                               (subscription.callback, elapsed, self.budget))
+    
+    def snapshot(self):
+        return [ObserverStats(subscription.callback, *record) 
+                for subscription, record in self.records.items()]
+
+#: Returned by a stage of a derived event to drop the value.
+_DROP = object()
+
+class _DerivedEvent(Event):
+    """
+    Event returned by :meth:`Event.derive` and friends.
+    
+    It registers a callback with the source event once it gets its
+    first observer. It unregisters once the source fires while there
+    are no observers left.
+    """
+    
+    __slots__ = ["_source", "_stages", "_link"]
+    
+    def __init__(self, source, stages):
+        Event.__init__(self)
+        self._source = source
+        self._stages = stages
+        self._link = None
+        
+    def _observed(self):
+        if self._link is None:
+            self._link = self._source.add_callback(self._forward)
+        
+    def _forward(self, value):
+        if not self._callbacks and not self._waiters:
+            self._unlink()
+            return
+        
+        for stage in self._stages:
+            value = stage(value)
+            if value is _DROP:
+                return
+        self.fire(value)
+        
+    def _unlink(self):
+        self._source.remove_callback(self._link)
+        self._link = None
+        
+    def _derive(self, stage):
+        if self._callbacks or self._waiters:
+            return Event._derive(self, stage)
+        # Nobody observes this event, so the new one can skip it
+        # and observe the source directly.
+        return _DerivedEvent(self._source, self._stages + (stage,))
+        
+    def _timed(self, cls, interval, clock):
+        if self._callbacks or self._waiters:
+            return Event._timed(self, cls, interval, clock)
+        return cls(self._source, self._stages, interval, clock)
+    
+class _TimedEvent(_DerivedEvent):
+    """
+    Derived event that passes values on at a later time.
+    
+    The last stage is `_receive`, which subclasses implement. It 
+    decides if a value is passed on immediately, by returning it, later,
+    by scheduling `_call` and keeping it in `_latest`, or not at all. 
+    Unless passed on immediately, it returns `_DROP`.
+    """
+    
+    __slots__ = ["_interval", "_clock", "_call", "_latest"]
+    
+    def __init__(self, source, stages, interval, clock):
+        _DerivedEvent.__init__(self, source, stages + (self._receive,))
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._interval = interval
+        self._clock = clock
+        
+        #: Pending `IDelayedCall` or `None`.
+        self._call = None
+        
+        #: Value to pass on when `_call` is due, `_DROP` if there is none.
+        self._latest = _DROP
+        
+    def _unlink(self):
+        _DerivedEvent._unlink(self)
+        # Nobody would get the pending value.
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+        self._latest = _DROP
+    
+    def _derive(self, stage):
+        # Values fired later would skip the stages that follow.
+        return Event._derive(self, stage)
+    
+    def _timed(self, cls, interval, clock):
+        return Event._timed(self, cls, interval, clock)
+        
+class _Coalesce(_TimedEvent):
+    """
+    See :meth:`Event.coalesce`.
+    """
+    
+    __slots__ = []
+    
+    def _receive(self, value):
+        self._latest = value
+        if self._call is None:
+            self._call = self._clock.callLater(0, self._due)
+        return _DROP
+    
+    def _due(self):
+        value = self._latest
+        self._call = None
+        self._latest = _DROP
+        self.fire(value)
+        
+class _Throttle(_TimedEvent):
+    """
+    See :meth:`Event.throttle`.
+    """
+    
+    __slots__ = []
+    
+    def _receive(self, value):
+        if self._call is None:
+            self._call = self._clock.callLater(self._interval, self._due)
+            return value
+        self._latest = value
+        return _DROP
+    
+    def _due(self):
+        value = self._latest
+        if value is _DROP:
+            self._call = None
+        else:
+            self._latest = _DROP
+            self._call = self._clock.callLater(self._interval, self._due)
+            self.fire(value)
+            
+class _Debounce(_TimedEvent):
+    """
+    See :meth:`Event.debounce`.
+    """
+    
+    __slots__ = []
+    
+    def _receive(self, value):
+        self._latest = value
+        if self._call is None:
+            self._call = self._clock.callLater(self._interval, self._due)
+        else:
+            self._call.reset(self._interval)
+        return _DROP
     
+    def _due(self):
+        value = self._latest
+        self._call = None
+        self._latest = _DROP
+        self.fire(value)
@@ -0,0 +1,115 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import collections
+
+from twisted.internet import defer
+from twisted.python import failure
+
+def memoize(function=None, cache_size=0, ttl=None, clock=None):
+    """
+    Decorator for functions that return deferreds, such as those 
+    decorated with :func:`~twistit.yieldefer`. Concurrent calls with equal
+    arguments share a single call of the decorated function.
+    
+    Each caller gets its own deferred. Cancelling it only cancels the
+    shared call once all callers waiting for it have cancelled.
+    
+    If `cache_size` is larger than zero, that many successful results are 
+    kept and returned to later calls with equal arguments. The least
+    recently used results are dropped first. If `ttl` is given, results 
+    are dropped after `ttl` seconds according to `clock`, which provides
+    `IReactorTime` and defaults to the reactor. `ttl` requires a 
+    `cache_size`.
+    
+    Calls with arguments that can't be hashed are never shared.
+    
+    Can be used as `@memoize` or as `@memoize(cache_size=100, ttl=60)`.
+    """
+    if function is not None and not callable(function):
+        raise TypeError("The options of memoize have to be passed as "
+                        "keyword arguments.")
+    if ttl is not None and cache_size <= 0:
+        raise ValueError("ttl requires a cache_size larger than zero.")
+    if function is None:
+        return lambda function: memoize(function, cache_size, ttl, clock)
+    
+    if ttl is not None and clock is None:
+        from twisted.internet import reactor as clock
+    
+    #: Maps the arguments of calls that are still running to
+    #: the shared call and the deferreds of the callers waiting for it.
+    running = {}
+    
+    #: Maps the arguments to `(result, expires)`, least recently
+    #: used first. `expires` is `None` if there is no `ttl`.
+    cache = collections.OrderedDict()
+    
+    def start(key, args, kwargs):
+        callers = []
+        call = defer.maybeDeferred(function, *args, **kwargs)
+        entry = running[key] = (key, call, callers)
+        
+        def finished(result):
+            if running.get(key) is entry:
+                del running[key]
+            if cache_size > 0 and not isinstance(result, failure.Failure):
+                expires = clock.seconds() + ttl if ttl is not None else None
+                cache[key] = (result, expires)
+                if len(cache) > cache_size:
+                    cache.popitem(last=False)
+            for d in callers:
+                if isinstance(result, failure.Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+        
+        d = join(*entry)
+        call.addBoth(finished)
+        return d
+    
+    def join(key, call, callers):
+        def cancel(d):
+            callers.remove(d)
+            if not callers:
+                del running[key]
+                call.cancel()
+        d = defer.Deferred(cancel)
+        callers.append(d)
+        return d
+    
+    def invoke(*args, **kwargs):
+        try:
+            key = (args, frozenset(kwargs.items()))
+            hash(key)
+        except TypeError:
+            return defer.maybeDeferred(function, *args, **kwargs)
+        
+        cached = cache.pop(key, None)
+        if cached is not None:
+            _, expires = cached
+            if expires is None or clock.seconds() < expires:
+                cache[key] = cached
+                return defer.succeed(cached[0])
+        
+        if key in running:
+            return join(*running[key])
+        return start(key, args, kwargs)
+    return invoke
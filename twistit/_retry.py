@@ -0,0 +1,128 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import random
+
+from twisted.internet import defer, task
+
+from twistit._yieldefer import yieldefer
+from twistit._timeout import timeout_deferred
+
+def retry(function=None, attempts=3, delay=0.1, factor=2.0, max_delay=None,
+          jitter=0.5, timeout=None, retry_on=(Exception,), budget=None, 
+          clock=None):
+    """
+    Decorator for functions that return deferreds, such as those 
+    decorated with :func:`~twistit.yieldefer`. Calls the function 
+    again if it fails, up to `attempts` times in total.
+    
+    Before the second attempt we wait `delay` seconds, before each
+    further attempt `factor` times as long as before, but never more
+    than `max_delay`. With `jitter` between zero and one, each wait is 
+    shortened by a random fraction of up to `jitter`, so that callers 
+    that failed together don't retry together.
+    
+    If `timeout` is given, each attempt is cancelled after that many
+    seconds with :func:`~twistit.timeout_deferred`, which counts as
+    a failed attempt.
+    
+    Only failures with one of the exception types in `retry_on` are 
+    retried, others are passed on right away, as is the failure of
+    the last attempt. A :class:`RetryBudget` shared by several 
+    functions limits how many retries they make in total.
+    
+    The waits and timeouts are scheduled with `clock`, which provides 
+    `IReactorTime` and defaults to the reactor. Cancelling the returned deferred
+    cancels the running attempt or the pending wait.
+    
+    Can be used as `@retry` or as `@retry(attempts=5, timeout=1)`.
+    """
+    if function is not None and not callable(function):
+        raise TypeError("The options of retry have to be passed as "
+                        "keyword arguments.")
+    if function is None:
+        return lambda function: retry(function, attempts, delay, factor, 
+                                      max_delay, jitter, timeout, retry_on, 
+                                      budget, clock)
+    
+    @yieldefer
+    def invoke(*args, **kwargs):
+        if budget is not None:
+            budget.deposit()
+        wait = delay
+        for attempt in range(1, attempts + 1):
+            d = defer.maybeDeferred(function, *args, **kwargs)
+            if timeout is not None:
+                d = timeout_deferred(d, timeout, clock=clock)
+            try:
+                result = yield d
+            except defer.CancelledError:
+                raise
+            except retry_on:
+                if attempt == attempts:
+                    raise
+                if budget is not None and not budget.withdraw():
+                    raise
+            else:
+                defer.returnValue(result)
+            
+            yield task.deferLater(clock or _reactor(), 
+                                  wait * (1 - jitter * random.random()), 
+                                  lambda: None)
+            wait *= factor
+            if max_delay is not None:
+                wait = min(wait, max_delay)
+    return invoke
+
+class RetryBudget(object):
+    """
+    Limits the retries of the functions decorated with :func:`retry`
+    it is given to. Without a limit, a failing backend would get
+    several times the load it got before, making matters worse.
+    
+    Every call earns `ratio` retries. The budget never holds more 
+    than `capacity` retries and starts full, so that a few retries 
+    are possible even after few calls.
+    """
+    
+    def __init__(self, ratio=0.1, capacity=10):
+        self._ratio = ratio
+        self._capacity = capacity
+        self._tokens = capacity
+        
+    def deposit(self):
+        """
+        Called for each call of a decorated function.
+        """
+        self._tokens = min(self._capacity, self._tokens + self._ratio)
+        
+    def withdraw(self):
+        """
+        Called before each retry. Returns `False` if the budget is 
+        used up and no retry should be made.
+        """
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+    
+def _reactor():
+    from twisted.internet import reactor
+    return reactor
@@ -0,0 +1,96 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import math
+
+class QuantileSketch(object):
+    """
+    Streaming estimate of the quantiles of positive values, such as
+    latencies, in bounded memory.
+    
+    The values are counted in buckets with geometrically growing bounds,
+    which gives estimates within a relative error of `accuracy` for
+    values between `minimum` and `maximum`. Smaller and larger values 
+    are counted as `minimum` and `maximum`.
+    
+    Older values fade out. Each value counts `e` times as much as the 
+    value added `window` values before it.
+    """
+    
+    def __init__(self, accuracy=0.05, minimum=1e-4, maximum=1e4, window=1000):
+        self._gamma = (1.0 + accuracy) / (1.0 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._minimum = minimum
+        buckets = int(math.ceil(math.log(maximum / minimum) / self._log_gamma))
+        
+        #: Bucket `i > 0` counts the values in 
+        #: `(minimum * gamma**(i-1), minimum * gamma**i]`,
+        #: bucket zero those up to `minimum`.
+        self._counts = [0.0] * (buckets + 1)
+        self._total = 0.0
+        
+        #: Weight of the next value. Grows rather than having the
+        #: counts shrink, so that adding a value is cheap.
+        self._weight = 1.0
+        self._growth = math.exp(1.0 / window)
+        
+        #: Number of values added.
+        self.count = 0
+        
+    def add(self, value):
+        """
+        Adds a value.
+        """
+        if value <= self._minimum:
+            index = 0
+        else:
+            index = int(math.ceil(math.log(value / self._minimum) / self._log_gamma))
+            index = min(index, len(self._counts) - 1)
+        self._counts[index] += self._weight
+        self._total += self._weight
+        self.count += 1
+        
+        self._weight *= self._growth
+        if self._weight > 1e100:
+            self._counts = [c / self._weight for c in self._counts]
+            self._total /= self._weight
+            self._weight = 1.0
+            
+    def quantile(self, q):
+        """
+        Returns the estimate of the `q`-quantile, `q` between zero and one,
+        or `None` if no values were added.
+        """
+        if not self.count:
+            return None
+        rank = q * self._total
+        cumulative = 0.0
+        for i, count in enumerate(self._counts):
+            if count:
+                # Rounding errors might keep us from reaching `rank`, 
+                # in which case we take the last non-empty bucket.
+                index = i
+                cumulative += count
+                if cumulative >= rank:
+                    break
+        if index == 0:
+            return self._minimum
+        # Value with the same relative distance to both bounds.
+        return 2 * self._minimum * self._gamma ** index / (self._gamma + 1)
@@ -18,17 +18,58 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import math
+
 from twisted.python import failure
-from twisted.internet import reactor, defer
+from twisted.internet import defer
+
+from twistit._sketch import QuantileSketch
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+if contextvars is not None:
+    _current_deadline = contextvars.ContextVar("twistit_deadline", default=None)
+else:
+    _current_deadline = None
 
-def timeout_deferred(deferred, timeout, error_message="Timeout occured"):
+def timeout_deferred(deferred, timeout, error_message="Timeout occured",
+                     clock=None):
     """
     Waits a given time, if the given deferred hasn't called back
     by then we cancel it. If the deferred was cancelled by the timeout,
     a `TimeoutError` error is produced.
     
+    Within a :class:`Deadline` the timeout is shortened to the time
+    left until the deadline. With `timeout` set to `None` only the
+    deadline applies. `timeout` can also be an :class:`AdaptiveTimeout`.
+    
+    The timeout is scheduled with `clock`, which provides `IReactorTime`
+    and defaults to the reactor. Pass a :class:`~twistit.TimeMock` in 
+    tests. With many pending timeouts a :class:`~twistit.TimerWheel` is 
+    cheaper.
+    
     Returns `deferred`.
     """
+    if isinstance(timeout, AdaptiveTimeout):
+        policy = timeout
+        timeout = policy.timeout()
+        if clock is None:
+            clock = policy._clock
+        count_timeout = _shortening_deadline(timeout) is None
+        timeout_deferred(deferred, timeout, error_message, clock)
+        return policy._track(deferred, count_timeout, clock)
+    
+    deadline = _shortening_deadline(timeout)
+    if deadline is not None:
+        return deadline._watch(deferred, error_message)
+    if timeout is None:
+        return deferred
+    
+    if clock is None:
+        from twisted.internet import reactor as clock
     
     timeout_occured = [False]
     
@@ -52,11 +93,305 @@ def timeout_deferred(deferred, timeout, error_message="Timeout occured"):
     def time_is_up():
         timeout_occured[0] = True
         deferred.cancel()
-    delayedCall = reactor.callLater(timeout, time_is_up)
+    delayedCall = clock.callLater(timeout, time_is_up)
 
     deferred.addBoth(got_result)
     return deferred
 
+def _shortening_deadline(timeout):
+    """
+    Returns the current :class:`Deadline` if it is due before `timeout`
+    seconds have passed, `None` otherwise.
+    """
+    if _current_deadline is None:
+        return None
+    deadline = _current_deadline.get()
+    if deadline is not None and (timeout is None or 
+                                 deadline.remaining() <= timeout):
+        return deadline
+    return None
+
+class _SharedTimeout(object):
+    """
+    Cancels the deferreds given to :meth:`_watch` with a single delayed 
+    call of `clock` at `time`, unless they called back before.
+    """
+    
+    def __init__(self, clock, time):
+        self._clock = clock
+        
+        #: Point in time of the timeout, according to `_clock`.
+        self.time = time
+        
+        #: Deferreds we cancel once the time has come.
+        self._pending = set()
+        
+        #: Delayed call for that, while there are pending deferreds.
+        self._timer = None
+        
+    def _watch(self, deferred, error_message):
+        remaining = self.time - self._clock.seconds()
+        if remaining > 0:
+            self._pending.add(deferred)
+            if self._timer is None:
+                self._timer = self._clock.callLater(remaining, self._expire)
+            
+        def got_result(result):
+            if deferred in self._pending:
+                # Deferred called back in time.
+                self._pending.remove(deferred)
+                if not self._pending:
+                    self._timer.cancel()
+                    self._timer = None
+                    self._idle()
+                return result
+            elif isinstance(result, failure.Failure) and result.check(defer.CancelledError):
+                raise TimeoutError(error_message)
+            else:
+                return result
+            
+        deferred.addBoth(got_result)
+        if remaining <= 0:
+            deferred.cancel()
+            if not self._pending:
+                self._idle()
+        return deferred
+    
+    def _expire(self):
+        self._timer = None
+        pending = self._pending
+        self._pending = set()
+        for d in pending:
+            d.cancel()
+        self._idle()
+        
+    def _idle(self):
+        """
+        Called when no deferreds are pending anymore.
+        """
+
+class Deadline(_SharedTimeout):
+    """
+    Context manager that limits the time the work started within it
+    may take, including the nested calls::
+    
+        @yieldefer
+        def handle(request):
+            with Deadline(2):
+                user = yield timeout_deferred(get_user(request), 1)
+                data = yield timeout_deferred(get_data(user), 1)
+                
+    Here both calls together get two seconds at most.
+    
+    :func:`timeout_deferred` shortens timeouts that would expire after
+    the deadline. Rather than scheduling one call per deferred for that, 
+    the deadline cancels all deferreds it is responsible for at once. 
+    Coroutines decorated with :func:`~twistit.yieldefer` inherit the 
+    deadline that was active when they were invoked. Deadlines within
+    deadlines can only make the time shorter.
+    
+    The time is measured with `clock`, which provides `IReactorTime`.
+    It defaults to the clock of the enclosing deadline, or the reactor.
+    
+    Requires the `contextvars` module of Python 3.7 or later.
+    """
+    
+    def __init__(self, timeout, clock=None):
+        _SharedTimeout.__init__(self, clock, None)
+        self._timeout = timeout
+        self._token = None
+        
+    def remaining(self):
+        """
+        Returns the number of seconds left until the deadline. Negative 
+        if the deadline has passed. The deadline is only known once the
+        `with` block has been entered.
+        """
+        if self.time is None:
+            raise RuntimeError("The deadline has not been entered yet.")
+        return self.time - self._clock.seconds()
+    
+    def __enter__(self):
+        if _current_deadline is None:
+            raise RuntimeError("Deadlines require the contextvars "
+                               "module of Python 3.7 or later.")
+        outer = _current_deadline.get()
+        if self._clock is None:
+            if outer is not None:
+                self._clock = outer._clock
+            else:
+                from twisted.internet import reactor
+                self._clock = reactor
+        self.time = self._clock.seconds() + self._timeout
+        if outer is not None and outer.time <= self.time:
+            self.time = outer.time
+        else:
+            self._token = _current_deadline.set(self)
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._token is not None:
+            _current_deadline.reset(self._token)
+            self._token = None
+    
+class TimeoutGroup(object):
+    """
+    Applies timeouts like :func:`timeout_deferred`, but with few delayed
+    calls when there are many deferreds with similar timeouts, such as 
+    requests sent in a burst::
+    
+        group = TimeoutGroup(tolerance=0.1)
+        for request in requests:
+            group.timeout_deferred(send(request), 5)
+    
+    Deferreds that time out within the same `tolerance` seconds share 
+    a delayed call, which cancels all of them that are still pending.
+    Timeouts occur up to `tolerance` seconds late.
+    
+    The time is measured with `clock`, which provides `IReactorTime`
+    and defaults to the reactor.
+    """
+    
+    def __init__(self, tolerance=0.1, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._tolerance = tolerance
+        self._clock = clock
+        
+        #: Maps the number of the interval of length `tolerance` to
+        #: the :class:`_GroupTimeout` for the deferreds timing out within. 
+        self._timeouts = {}
+        
+    def timeout_deferred(self, deferred, timeout, error_message="Timeout occured"):
+        """
+        Same as :func:`timeout_deferred`, including the shortening to 
+        the current :class:`Deadline` and the support for 
+        :class:`AdaptiveTimeout`.
+        """
+        if isinstance(timeout, AdaptiveTimeout):
+            policy = timeout
+            timeout = policy.timeout()
+            count_timeout = _shortening_deadline(timeout) is None
+            self.timeout_deferred(deferred, timeout, error_message)
+            return policy._track(deferred, count_timeout, self._clock)
+        
+        deadline = _shortening_deadline(timeout)
+        if deadline is not None:
+            return deadline._watch(deferred, error_message)
+        if timeout is None:
+            return deferred
+        
+        time = self._clock.seconds() + timeout
+        interval = int(math.ceil(time / self._tolerance))
+        shared = self._timeouts.get(interval)
+        if shared is None:
+            shared = _GroupTimeout(self, interval)
+            self._timeouts[interval] = shared
+        return shared._watch(deferred, error_message)
+    
+    
+class _GroupTimeout(_SharedTimeout):
+    """
+    Timeout for the deferreds of a :class:`TimeoutGroup` that time out 
+    within the same interval.
+    """
+    
+    def __init__(self, group, interval):
+        _SharedTimeout.__init__(self, group._clock, interval * group._tolerance)
+        self._group = group
+        self._interval = interval
+        
+    def _idle(self):
+        if self._group._timeouts.get(self._interval) is self:
+            del self._group._timeouts[self._interval]
+
+class AdaptiveTimeout(object):
+    """
+    Timeout that follows the latencies of the calls it is applied to. 
+    Can be passed as `timeout` to :func:`timeout_deferred` and to 
+    everything that passes it on, such as :func:`~twistit.retry`::
+    
+        fetch_timeout = AdaptiveTimeout(initial=5)
+        
+        def fetch(key):
+            return timeout_deferred(backend.fetch(key), fetch_timeout)
+            
+    The timeout is `multiplier` times the `percentile` of the latencies 
+    of recent calls, limited to `minimum` and `maximum`. Until there are
+    `min_samples` latencies, the timeout is `initial`. The latencies are 
+    kept in a :class:`~twistit.QuantileSketch` dominated by the last `window` 
+    calls, so the memory needed is bounded.
+    
+    Successful calls count with their latency. Calls that time out count 
+    with the time until the timeout, so that a timeout that is too short
+    gets longer. Other failures don't count.
+    
+    `clock` provides `IReactorTime` and defaults to the reactor. It is 
+    used to schedule the timeout and to measure the latencies, unless
+    :func:`timeout_deferred` or the :class:`TimeoutGroup` is given a 
+    clock of its own, which is then used for both.
+    """
+    
+    #: Number of new latencies after which we compute the timeout again.
+    _REFRESH = 16
+    
+    def __init__(self, initial, percentile=0.99, multiplier=2.0, 
+                 minimum=0.0, maximum=None, window=1000, min_samples=20, 
+                 clock=None):
+        self._initial = initial
+        self._percentile = percentile
+        self._multiplier = multiplier
+        self._minimum = minimum
+        self._maximum = maximum
+        self._min_samples = min_samples
+        self._clock = clock
+        self._sketch = QuantileSketch(window=window)
+        
+        #: Last computed timeout and the latencies added since.
+        self._timeout = None
+        self._stale = 0
+        
+    def timeout(self):
+        """
+        Returns the timeout in seconds for the next call.
+        """
+        if self._sketch.count < self._min_samples:
+            return self._initial
+        if self._timeout is None or self._stale >= self._REFRESH:
+            timeout = self._multiplier * self._sketch.quantile(self._percentile)
+            timeout = max(self._minimum, timeout)
+            if self._maximum is not None:
+                timeout = min(self._maximum, timeout)
+            self._timeout = timeout
+            self._stale = 0
+        return self._timeout
+    
+    def record(self, latency):
+        """
+        Adds the latency of a call, in seconds. Called for the calls 
+        this timeout is applied to, but can also be used to add latencies
+        measured otherwise.
+        """
+        self._sketch.add(latency)
+        self._stale += 1
+    
+    def _track(self, deferred, count_timeout, clock):
+        # Measure with the clock the timeout is scheduled with.
+        if clock is None:
+            from twisted.internet import reactor as clock
+        start = clock.seconds()
+        
+        def got_result(result):
+            latency = clock.seconds() - start
+            if not isinstance(result, failure.Failure):
+                self.record(latency)
+            elif result.check(TimeoutError) and count_timeout:
+                # Timed out by us, not by a `Deadline`.
+                self.record(latency)
+            return result
+        deferred.addBoth(got_result)
+        return deferred
+
 class TimeoutError(Exception):
     """
     Error produced if a deferred times out due to :func:`timeout_deferred`.
@@ -0,0 +1,184 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import logging
+import math
+
+from zope.interface import implementer
+from twisted.internet import interfaces, error
+
+logger = logging.getLogger(__name__)
+
+@implementer(interfaces.IReactorTime)
+class TimerWheel(object):
+    """
+    Schedules calls like the reactor does, but with a resolution of
+    `tick` seconds. Calls are run up to one tick late.
+    
+    The reactor keeps its delayed calls in a heap, scheduling or 
+    cancelling one costs `O(log n)`. Here both take constant time, which 
+    makes a difference with many pending calls that are mostly cancelled
+    before they are due, such as timeouts::
+    
+        wheel = TimerWheel(tick=0.1)
+        timeout_deferred(d, 30, clock=wheel)
+        
+    The calls are kept in `slots` buckets, one per tick, wrapping 
+    around. A single delayed call of `clock` (the reactor by default)
+    runs once per tick while there are pending calls. Choose `slots`
+    such that `slots * tick` covers the typical delays.
+    """
+    
+    def __init__(self, tick=0.1, slots=512, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._tick = tick
+        self._clock = clock
+        self._slots = [set() for _ in range(slots)]
+        
+        #: Number of the last tick we processed.
+        self._current = int(clock.seconds() // tick)
+        
+        #: Number of pending calls.
+        self._count = 0
+        
+        #: Delayed call of `clock` that processes the next tick.
+        self._driver = None
+        
+        #: Number of the tick `_driver` will process.
+        self._target = None
+    
+    def seconds(self):
+        return self._clock.seconds()
+    
+    def callLater(self, delay, f, *args, **kw):
+        call = _WheelCall(self, self._clock.seconds() + delay, f, args, kw)
+        self._arm(call)
+        return call
+    
+    def getDelayedCalls(self):
+        return tuple(call for slot in self._slots for call in slot)
+    
+    def _arm(self, call):
+        if not self._count:
+            # Skip the ticks we were idle instead of processing them later.
+            now = int(self._clock.seconds() // self._tick)
+            self._current = max(self._current, now)
+        due = max(self._current + 1, int(math.ceil(call.time / self._tick)))
+        call._due = due
+        call._slot = self._slots[due % len(self._slots)]
+        call._slot.add(call)
+        self._count += 1
+        if self._driver is None:
+            self._schedule()
+            
+    def _disarm(self, call):
+        call._slot.remove(call)
+        call._slot = None
+        self._count -= 1
+        
+    def _advance(self):
+        self._driver = None
+        
+        # Floating point errors must not make us wait for the same tick again.
+        now = max(self._target, int(self._clock.seconds() // self._tick))
+        
+        due = []
+        ticks = min(now - self._current, len(self._slots))
+        for tick in range(self._current + 1, self._current + 1 + ticks):
+            slot = self._slots[tick % len(self._slots)]
+            due.extend(call for call in slot if call._due <= now)
+        for call in due:
+            self._disarm(call)
+        self._current = now
+        
+        due.sort(key=lambda call: call.time)
+        for call in due:
+            # Skip the calls cancelled or rescheduled by the ones before.
+            if not call.cancelled and call._slot is None:
+                call.called = True
+                try:
+                    call.f(*call.args, **call.kw)
+                except:
+                    logger.exception("Delayed call %r failed." % call)
+        
+        if self._count and self._driver is None:
+            self._schedule()
+            
+    def _schedule(self):
+        self._target = self._current + 1
+        delay = self._target * self._tick - self._clock.seconds()
+        self._driver = self._clock.callLater(max(0, delay), self._advance)
+        
+        
+@implementer(interfaces.IDelayedCall)
+class _WheelCall(object):
+    """
+    Delayed call scheduled by :class:`TimerWheel`.
+    """
+    
+    __slots__ = ("_wheel", "_slot", "_due", "time", "f", "args", "kw", 
+                 "called", "cancelled")
+    
+    def __init__(self, wheel, time, f, args, kw):
+        self._wheel = wheel
+        self._slot = None
+        self._due = None
+        self.time = time
+        self.f = f
+        self.args = args
+        self.kw = kw
+        self.called = False
+        self.cancelled = False
+        
+    def getTime(self):
+        return self.time
+    
+    def cancel(self):
+        self._check()
+        self.cancelled = True
+        if self._slot is not None:
+            self._wheel._disarm(self)
+            
+    def delay(self, secondsLater):
+        self._check()
+        if self._slot is not None:
+            self._wheel._disarm(self)
+        self.time += secondsLater
+        self._wheel._arm(self)
+        
+    def reset(self, secondsFromNow):
+        self._check()
+        if self._slot is not None:
+            self._wheel._disarm(self)
+        self.time = self._wheel.seconds() + secondsFromNow
+        self._wheel._arm(self)
+        
+    def active(self):
+        return not self.called and not self.cancelled
+    
+    def _check(self):
+        if self.called:
+            raise error.AlreadyCalled()
+        elif self.cancelled:
+            raise error.AlreadyCancelled()
+        
+    def __repr__(self):
+        return "_WheelCall(%r, %r, %r)" % (self.f, self.args, self.kw)
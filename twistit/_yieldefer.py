@@ -18,19 +18,52 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import collections
+import inspect
+import timeit
+import types
+
 from twisted.internet import defer
 from twisted.python import failure
 
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+if hasattr(types, "CoroutineType"):
+    _iscoroutinefunction = inspect.iscoroutinefunction
+    _COROUTINE_TYPES = (types.GeneratorType, types.CoroutineType)
+else:
+    _iscoroutinefunction = lambda function: False
+    _COROUTINE_TYPES = (types.GeneratorType,)
+
 def yieldefer(function):
     """
     Replacement for :func:`defer.inlineCallbacks` that supports cancellation.
+    
+    Works with generator functions and with `async def` functions which
+    `await` deferreds. Other functions are invoked directly. If they return
+    a generator or a coroutine it is run, any other value but a deferred
+    is wrapped into one.
     """
-    defer.inlineCallbacks
-    return lambda *args, **kwargs: _yielddefer(function, *args, **kwargs)
+    if inspect.isgeneratorfunction(function) or _iscoroutinefunction(function):
+        def invoke(*args, **kwargs):
+            try:
+                coroutine = function(*args, **kwargs)
+            except:
+                return defer.fail()
+            if _profiler is not None:
+                coroutine = _profiler.wrap(function, coroutine)
+            return _run(coroutine)
+        return invoke
+    else:
+        return lambda *args, **kwargs: _yielddefer(function, *args, **kwargs)
 
 def _yielddefer(function, *args, **kwargs):
     """
-    Called if a function decorated with :func:`yieldefer` is invoked.
+    Called if a function decorated with :func:`yieldefer` is invoked
+    that is neither a generator function nor an `async def` function.
     """
     try:
         retval = function(*args, **kwargs)
@@ -39,56 +72,453 @@ def _yielddefer(function, *args, **kwargs):
     
     if isinstance(retval, defer.Deferred):
         return retval
-    
-    if not (hasattr(retval, '__iter__') and 
-            hasattr(retval, 'next') and 
-            hasattr(retval, 'send') and 
-            hasattr(retval, 'throw')):
+    elif isinstance(retval, _COROUTINE_TYPES):
+        if _profiler is not None:
+            retval = _profiler.wrap(function, retval)
+        return _run(retval)
+    else:
         return defer.succeed(retval)
     
-    iterator = retval
+def _run(iterator, stream=None):
+    """
+    Runs the given generator or coroutine. Returns a deferred
+    for its return value. Items passed to :func:`emit` are put
+    into `stream`.
+    
+    Each step runs in a copy of the context at the time of this call,
+    so that context variables (Python 3.7 and later) set by the caller
+    are visible to the generator, no matter from where it is resumed.
+    """
+    if contextvars is not None:
+        run_in_context = contextvars.copy_context().run
+    else:
+        run_in_context = None
+    send = iterator.send
     
+    #: The deferred the generator is currently waiting for.
+    awaited = [None]
     
-    def maybe_deferred(val):
-        # We don't want exceptions to become twisted failures
-        # because exceptions thrown by the generator methods
-        # indicate exceptions thrown by the code _between_ the
-        # yield statements or it indicates the end of the 
-        # iteration.
-        if isinstance(val, defer.Deferred):
-            return val
-        else:
-            return defer.succeed(val)
+    #: Set once the returned deferred got cancelled.
+    cancelled = [False]
+    
+    def cancel(_):
+        # The generator gets the outcome of the cancelled deferred, 
+        # usually a `CancelledError`. If it handles the error and waits 
+        # for something else, that gets cancelled too. If it doesn't 
+        # produce a result, `Deferred.cancel` fails the returned deferred.
+        cancelled[0] = True
+        if awaited[0] is not None:
+            awaited[0].cancel()
+    result = defer.Deferred(cancel)
+    
+    def resume(value):
+        """
+        Runs the generator until it waits for a deferred that has no 
+        result yet or until it is done.
+        
+        Deferreds that already have a result are handled in this
+        loop instead of from within their callbacks. Otherwise each
+        of them would add frames to the stack.
+        """
+        awaited[0] = None
+        while True:
+            try:
+                if isinstance(value, failure.Failure):
+                    if run_in_context is None:
+                        d = value.throwExceptionIntoGenerator(iterator)
+                    else:
+                        d = run_in_context(value.throwExceptionIntoGenerator,
+                                           iterator)
+                elif run_in_context is None:
+                    d = send(value)
+                else:
+                    d = run_in_context(send, value)
+            except StopIteration as e:
+                # Python 2 generators can't return values.
+                if not result.called:
+                    result.callback(getattr(e, "value", None))
+                return
+            except defer._DefGen_Return as e:
+                if not result.called:
+                    result.callback(e.value)
+                return
+            except:
+                if not result.called:
+                    result.errback()
+                return
+            
+            if not isinstance(d, defer.Deferred):
+                if not isinstance(d, _Emit):
+                    value = d
+                    continue
+                if stream is None:
+                    value = failure.Failure(TypeError(
+                        "emit() is only valid in functions decorated "
+                        "with yieldstream."))
+                    continue
+                d = stream._put(d.item)
+                if d is None:
+                    value = None
+                    continue
+            
+            if d.called and not d.paused and \
+                    not isinstance(d.result, failure.Failure):
+                # Same as `got_result` below, without the overhead.
+                # Failures take the long way, the deferred has to
+                # know that they got handled.
+                value = d.result
+                d.result = None
+                continue
+            
+            if cancelled[0]:
+                d.cancel()
+            
+            # `waiting[0]` is True until the deferred has a result or until
+            # we stop waiting for it synchronously. `waiting[1]` is the 
+            # result it got while we were still waiting.
+            waiting = [True, None]
+            def got_result(value):
+                if waiting[0]:
+                    waiting[0] = False
+                    waiting[1] = value
+                else:
+                    resume(value)
+            d.addBoth(got_result)
+            
+            if waiting[0]:
+                # No result yet, `got_result` will resume.
+                waiting[0] = False
+                awaited[0] = d
+                return
+            value = waiting[1]
+            
+    resume(None)
+    return result
+
+    
+def yieldstream(function=None, buffer_size=1):
+    """
+    Decorator for generator functions and `async def` functions 
+    that produce a stream of items. They work like those decorated
+    with :func:`yieldefer`, but can pass items to :func:`emit` along 
+    the way::
+    
+        @yieldstream
+        def rows(query):
+            cursor = yield execute(query)
+            for row in cursor:
+                yield emit(row)
+    
+    Invoking the function returns a :class:`Stream` to get the items from.
+    Once `buffer_size` items are waiting to be taken, the function is
+    paused until the consumer catches up.
+    
+    Can also be used as `@yieldstream(buffer_size=100)`.
+    """
+    if function is not None and not callable(function):
+        raise TypeError("The options of yieldstream have to be passed as "
+                        "keyword arguments.")
+    if function is None:
+        return lambda function: yieldstream(function, buffer_size)
     
-    def success(value):
+    def invoke(*args, **kwargs):
+        stream = Stream(buffer_size)
         try:
-            d = maybe_deferred(iterator.send(value))
-            d.addCallbacks(success, fail)
-            return d
-        except StopIteration:
-            return None
-        except defer._DefGen_Return as e:
-            return e.value
+            iterator = function(*args, **kwargs)
+        except:
+            stream._finish(failure.Failure())
+        else:
+            if _profiler is not None:
+                iterator = _profiler.wrap(function, iterator)
+            stream._start(iterator)
+        return stream
+    return invoke
+
+def emit(item):
+    """
+    Passes an item to the consumer of a :class:`Stream`. Only valid 
+    within functions decorated with :func:`yieldstream` as 
+    `yield emit(item)` or `await emit(item)`.
+    """
+    return _Emit(item)
+
+class _Emit(object):
+    """
+    Returned by :func:`emit`.
+    """
+    
+    __slots__ = ["item"]
+    
+    def __init__(self, item):
+        self.item = item
+        
+    def __await__(self):
+        yield self
+
+class EndOfStream(Exception):
+    """
+    Produced by :meth:`Stream.next` once there are no more items.
+    """
+
+class Stream(object):
+    """
+    Items produced by a function decorated with :func:`yieldstream`.
+    
+    The consumer takes them one at a time with :meth:`next` or 
+    has them passed to a callback with :meth:`consume`. On Python 3
+    `async for item in stream` works too.
+    """
+    
+    def __init__(self, buffer_size):
+        self._buffer_size = buffer_size
+        
+        #: Items emitted but not yet taken.
+        self._buffer = collections.deque()
+        
+        #: Deferreds returned by :meth:`next` that wait for an item.
+        self._consumers = collections.deque()
+        
+        #: Deferred the producer waits on until there is room in 
+        #: the buffer, or `None`.
+        self._producer = None
+        
+        #: Deferred returned by `_run` for the producer.
+        self._done = None
+        
+        #: `None` while the producer is running. Afterwards, the 
+        #: failure consumers get once the buffer is empty.
+        self._end = None
+        
+    def next(self):
+        """
+        Returns a deferred that calls back with the next item. Fails 
+        with :class:`EndOfStream` if there are no more items, or with
+        the failure of the producer.
+        """
+        if self._buffer:
+            item = self._buffer.popleft()
+            if self._producer is not None and \
+                    (not self._buffer or len(self._buffer) < self._buffer_size):
+                producer = self._producer
+                self._producer = None
+                producer.callback(None)
+            return defer.succeed(item)
+        
+        if self._end is not None:
+            return defer.fail(self._end)
+        
+        d = defer.Deferred(self._consumers.remove)
+        self._consumers.append(d)
+        return d
+    
+    def consume(self, callback):
+        """
+        Invokes `callback` for each item. If it returns a deferred, 
+        the next item is taken once it has a result. Returns a deferred
+        that calls back with `None` after the last item. If the 
+        callback fails or the returned deferred is cancelled, the 
+        producer is cancelled.
+        """
+        return _run(self._consume(callback))
     
-    def fail(failure):
+    def cancel(self):
+        """
+        Cancels the producer.
+        """
+        if self._done is not None:
+            self._done.cancel()
+        
+    def _consume(self, callback):
         try:
-            d = maybe_deferred(failure.throwExceptionIntoGenerator(iterator))
-            #d = iterator.throw(failure.value)
-            d.addCallbacks(success, fail)
-            return d
-        except StopIteration:
+            while True:
+                try:
+                    item = yield self.next()
+                except EndOfStream:
+                    return
+                yield callback(item)
+        except:
+            # Failed or cancelled, nobody takes the remaining items.
+            self.cancel()
+            raise
+    
+    def __aiter__(self):
+        return self
+    
+    def __anext__(self):
+        def stop(failure):
+            failure.trap(EndOfStream)
+            raise StopAsyncIteration()
+        return self.next().addErrback(stop)
+    
+    def _start(self, iterator):
+        self._done = _run(iterator, self)
+        self._done.addBoth(self._finish)
+        
+    def _put(self, item):
+        """
+        Invoked when the producer emits `item`. Returns `None` or a 
+        deferred the producer has to wait on.
+        """
+        if self._consumers:
+            self._consumers.popleft().callback(item)
             return None
-        except defer._DefGen_Return as e:
-            return e.value
         
-    try:
-        d = maybe_deferred(iterator.next())
-        d.addCallbacks(success, fail)
-    except StopIteration:
-        d = defer.succeed(None)
-    except defer._DefGen_Return as e:
-        d = defer.succeed(e.value)
-    except:
-        d = defer.fail()
+        self._buffer.append(item)
+        if len(self._buffer) < self._buffer_size:
+            return None
         
-    return d
\ No newline at end of file
+        def cancel(d):
+            self._producer = None
+        self._producer = defer.Deferred(cancel)
+        return self._producer
+    
+    def _finish(self, result):
+        if isinstance(result, failure.Failure):
+            self._end = result
+        else:
+            self._end = failure.Failure(EndOfStream())
+        while self._consumers:
+            self._consumers.popleft().errback(self._end)
+
+
+#: :class:`_Profiler` while profiling is enabled.
+_profiler = None
+
+def enable_profiling(timer=None):
+    """
+    Starts to record how functions decorated with :func:`yieldefer`
+    or :func:`yieldstream` spend their time. Discards what was recorded
+    before. See :func:`get_profile`.
+    
+    `timer` is a function that returns the time in seconds, by default 
+    :func:`timeit.default_timer`. 
+    
+    Invocations that started before profiling was enabled are not recorded.
+    While profiling is disabled, the only cost is a check per invocation.
+    """
+    global _profiler
+    _profiler = _Profiler(timer if timer is not None else timeit.default_timer)
+
+def disable_profiling():
+    """
+    Stops recording and discards what was recorded.
+    """
+    global _profiler
+    _profiler = None
+    
+def get_profile():
+    """
+    Returns a list of :class:`CoroutineProfile`, one for each
+    decorated function invoked since :func:`enable_profiling`. 
+    Returns an empty list if profiling isn't enabled.
+    """
+    if _profiler is None:
+        return []
+    return _profiler.snapshot()
+
+#: Profile of a decorated function as returned by :func:`get_profile`.
+#: `active_time` is the time spent running the function, between the
+#: `yield` statements. `suspended` maps `(filename, line)` of each 
+#: `yield` or `await` to a `(count, seconds)` tuple with the time the 
+#: function waited there. Times are in seconds.
+CoroutineProfile = collections.namedtuple("CoroutineProfile", 
+    ["function", "invocations", "completions", "failures", 
+     "active_time", "suspended"])
+
+class _Profiler(object):
+    """
+    Data recorded while profiling is enabled.
+    """
+    
+    def __init__(self, timer):
+        self.timer = timer
+        
+        #: Maps functions to their :class:`_ProfileRecord`.
+        self.records = collections.OrderedDict()
+        
+    def wrap(self, function, iterator):
+        """
+        Returns an object that behaves like the given generator or 
+        coroutine, and records the profile of `function`.
+        """
+        record = self.records.get(function)
+        if record is None:
+            record = self.records[function] = _ProfileRecord()
+        record.invocations += 1
+        return _ProfiledIterator(self.timer, record, iterator)
+    
+    def snapshot(self):
+        return [CoroutineProfile(function, record.invocations, 
+                                 record.completions, record.failures,
+                                 record.active_time, 
+                                 dict((site, tuple(suspended)) for site, suspended 
+                                      in record.suspended.items()))
+                for function, record in self.records.items()]
+    
+class _ProfileRecord(object):
+    
+    __slots__ = ["invocations", "completions", "failures", 
+                 "active_time", "suspended"]
+    
+    def __init__(self):
+        self.invocations = 0
+        self.completions = 0
+        self.failures = 0
+        self.active_time = 0.0
+        
+        #: Maps `(filename, line)` to `[count, seconds]`.
+        self.suspended = {}
+    
+class _ProfiledIterator(object):
+    """
+    Wraps a generator or coroutine and measures the time spent in
+    and between the calls to `send` and `throw`.
+    """
+    
+    __slots__ = ["_timer", "_record", "_iterator", "_site", "_suspended_at"]
+    
+    def __init__(self, timer, record, iterator):
+        self._timer = timer
+        self._record = record
+        self._iterator = iterator
+        
+        #: `(filename, line)` where the iterator is suspended, if any.
+        self._site = None
+        self._suspended_at = None
+        
+    def send(self, value):
+        return self._step(self._iterator.send, value)
+    
+    def throw(self, *args):
+        return self._step(self._iterator.throw, *args)
+    
+    def _step(self, method, *args):
+        record = self._record
+        start = self._timer()
+        if self._site is not None:
+            suspended = record.suspended.get(self._site)
+            if suspended is None:
+                suspended = record.suspended[self._site] = [0, 0.0]
+            suspended[0] += 1
+            suspended[1] += start - self._suspended_at
+            
+        try:
+            yielded = method(*args)
+        except (StopIteration, defer._DefGen_Return):
+            record.completions += 1
+            raise
+        except:
+            record.failures += 1
+            raise
+        finally:
+            record.active_time += self._timer() - start
+        
+        frame = getattr(self._iterator, "gi_frame", None)
+        if frame is None:
+            frame = getattr(self._iterator, "cr_frame", None)
+        if frame is not None:
+            self._site = (frame.f_code.co_filename, frame.f_lineno)
+        else:
+            self._site = None
+        self._suspended_at = self._timer()
+        return yielded
@@ -0,0 +1,159 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+import twistit
+
+from twisted.internet import defer
+
+class TestGather(unittest.TestCase):
+    """
+    Unit tests for :func:`twistit.gather`.
+    """
+    
+    def test_empty(self):
+        d = twistit.gather([])
+        self.assertEqual([], twistit.extract(d))
+        
+    def test_results(self):
+        a = defer.Deferred()
+        b = defer.Deferred()
+        d = twistit.gather([a, b])
+        b.callback(2)
+        self.assertFalse(twistit.has_result(d))
+        a.callback(1)
+        self.assertEqual([1, 2], twistit.extract(d))
+        
+    def test_fail_fast(self):
+        a = defer.Deferred()
+        b = defer.Deferred()
+        d = twistit.gather([a, b])
+        a.errback(ValueError())
+        self.assertTrue(b.called)
+        self.assertRaises(ValueError, twistit.extract, d)
+        
+    def test_cancel(self):
+        a = defer.Deferred()
+        b = defer.succeed(2)
+        d = twistit.gather([a, b])
+        d.cancel()
+        self.assertTrue(a.called)
+        self.assertRaises(defer.CancelledError, twistit.extract, d)
+        
+    def test_cancel_coroutine(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def coroutine():
+            yield blocking
+            
+        failing = defer.Deferred()
+        d = twistit.gather([coroutine(), failing])
+        failing.errback(ValueError())
+        self.assertTrue(blocking.called)
+        self.assertRaises(ValueError, twistit.extract, d)
+        
+
+class TestRace(unittest.TestCase):
+    """
+    Unit tests for :func:`twistit.race`.
+    """
+    
+    def test_empty(self):
+        self.assertRaises(ValueError, twistit.race, [])
+        
+    def test_first_wins(self):
+        a = defer.Deferred()
+        b = defer.Deferred()
+        d = twistit.race([a, b])
+        b.callback(2)
+        self.assertTrue(a.called)
+        self.assertEqual(2, twistit.extract(d))
+        
+    def test_first_fails(self):
+        a = defer.Deferred()
+        b = defer.Deferred()
+        d = twistit.race([a, b])
+        a.errback(ValueError())
+        self.assertTrue(b.called)
+        self.assertRaises(ValueError, twistit.extract, d)
+        
+    def test_cancel(self):
+        a = defer.Deferred()
+        b = defer.Deferred()
+        d = twistit.race([a, b])
+        d.cancel()
+        self.assertTrue(a.called)
+        self.assertTrue(b.called)
+        self.assertRaises(defer.CancelledError, twistit.extract, d)
+        
+
+class TestBoundedMap(unittest.TestCase):
+    """
+    Unit tests for :func:`twistit.bounded_map`.
+    """
+    
+    def setUp(self):
+        self.pending = {}
+        
+    def function(self, item):
+        d = defer.Deferred()
+        self.pending[item] = d
+        return d
+    
+    def test_empty(self):
+        d = twistit.bounded_map(self.function, [], 2)
+        self.assertEqual([], twistit.extract(d))
+        
+    def test_immediate(self):
+        d = twistit.bounded_map(lambda x:2*x, range(10000), 2)
+        self.assertEqual([2*x for x in range(10000)], twistit.extract(d))
+        
+    def test_concurrency(self):
+        d = twistit.bounded_map(self.function, range(4), 2)
+        self.assertEqual([0, 1], sorted(self.pending))
+        self.pending[1].callback("b")
+        self.assertEqual([0, 1, 2], sorted(self.pending))
+        self.pending[0].callback("a")
+        self.pending[2].callback("c")
+        self.assertFalse(twistit.has_result(d))
+        self.pending[3].callback("d")
+        self.assertEqual(["a", "b", "c", "d"], twistit.extract(d))
+        
+    def test_fail_fast(self):
+        d = twistit.bounded_map(self.function, range(4), 2)
+        self.pending[1].errback(ValueError())
+        self.assertTrue(self.pending[0].called)
+        self.assertEqual([0, 1], sorted(self.pending))
+        self.assertRaises(ValueError, twistit.extract, d)
+        
+    def test_raises(self):
+        def function(item):
+            raise ValueError()
+        d = twistit.bounded_map(function, range(4), 2)
+        self.assertRaises(ValueError, twistit.extract, d)
+        
+    def test_cancel(self):
+        d = twistit.bounded_map(self.function, range(4), 2)
+        d.cancel()
+        self.assertTrue(self.pending[0].called)
+        self.assertTrue(self.pending[1].called)
+        self.assertEqual([0, 1], sorted(self.pending))
+        self.assertRaises(defer.CancelledError, twistit.extract, d)
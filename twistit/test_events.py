@@ -19,8 +19,12 @@
 # IN THE SOFTWARE.
 
 import unittest
+import gc
+import logging
 import twistit
 
+from twisted.internet import defer
+
 class TestEvents(unittest.TestCase):
     """
     Unit tests for :class:`twistit.Event`.
@@ -105,3 +109,567 @@ class TestEvents(unittest.TestCase):
         target.fire(42)
         
         self.assertEqual([42,84], result)
+        
+    def test_remove_handle(self):
+        result = [None]
+        def cb(value):
+            result[0] = value
+        
+        target = twistit.Event()
+        handle = target.add_callback(cb)
+        target.remove_callback(handle)
+        target.fire(42)
+        self.assertEqual(None, result[0])
+        
+    def test_remove_handle_twice(self):
+        target = twistit.Event()
+        handle = target.add_callback(lambda value:None)
+        target.remove_callback(handle)
+        self.assertRaises(ValueError, target.remove_callback, handle)
+        
+    def test_remove_unknown(self):
+        target = twistit.Event()
+        self.assertRaises(ValueError, target.remove_callback, lambda value:None)
+        
+    def test_remove_duplicate(self):
+        result = []
+        
+        target = twistit.Event()
+        target.add_callback(result.append)
+        target.add_callback(result.append)
+        target.remove_callback(result.append)
+        target.fire(42)
+        self.assertEqual([42], result)
+        
+    def test_remove_keeps_order(self):
+        result = []
+        
+        target = twistit.Event()
+        target.add_callback(lambda value:result.append(0))
+        handle = target.add_callback(lambda value:result.append(1))
+        target.add_callback(lambda value:result.append(2))
+        target.remove_callback(handle)
+        target.fire(42)
+        self.assertEqual([0, 2], result)
+        
+    def test_remove_during_fire(self):
+        result = []
+        
+        target = twistit.Event()
+        def cb0(value):
+            result.append(0)
+            target.remove_callback(cb0)
+            target.remove_callback(handle)
+        target.add_callback(cb0)
+        handle = target.add_callback(lambda value:result.append(1))
+        target.fire(42)
+        target.fire(43)
+        self.assertEqual([0, 1], result)
+        
+    def test_add_during_fire(self):
+        result = []
+        
+        target = twistit.Event()
+        def cb0(value):
+            result.append((0, value))
+            target.add_callback(lambda value:result.append((1, value)))
+            target.remove_callback(cb0)
+        target.add_callback(cb0)
+        target.fire(42)
+        target.fire(43)
+        self.assertEqual([(0, 42), (1, 43)], result)
+        
+    def test_fire_repeatedly(self):
+        result = []
+        
+        target = twistit.Event()
+        target.add_callback(lambda value:result.append(0))
+        target.fire(42)
+        target.add_callback(lambda value:result.append(1))
+        target.fire(43)
+        target.fire(44)
+        self.assertEqual([0, 0, 1, 0, 1], result)
+        
+    def test_next_event_many(self):
+        result = []
+        
+        target = twistit.Event()
+        for _ in range(3):
+            target.next_event().addCallback(result.append)
+        target.fire(42)
+        target.fire(43)
+        self.assertEqual([42, 42, 42], result)
+        
+    def test_next_event_after_callbacks(self):
+        result = []
+        
+        target = twistit.Event()
+        target.next_event().addCallback(lambda value:result.append(1))
+        target.add_callback(lambda value:result.append(0))
+        target.fire(42)
+        self.assertEqual([0, 1], result)
+        
+    def test_next_event_cancel(self):
+        result = []
+        
+        target = twistit.Event()
+        d = target.next_event()
+        d.addCallbacks(result.append, lambda failure:result.append("cancelled"))
+        d.cancel()
+        target.fire(42)
+        self.assertEqual(["cancelled"], result)
+        
+    def test_next_event_canceller(self):
+        cancelled = []
+        
+        target = twistit.Event()
+        d = target.next_event(cancelled.append)
+        d.addErrback(lambda failure:None)
+        d.cancel()
+        self.assertEqual([d], cancelled)
+        
+    def test_next_event_during_fire(self):
+        result = []
+        
+        target = twistit.Event()
+        def cb(value):
+            target.next_event().addCallback(result.append)
+        target.add_callback(cb)
+        target.fire(42)
+        self.assertEqual([], result)
+        target.fire(43)
+        self.assertEqual([43], result)
+        
+    def test_fire_many(self):
+        result = []
+        
+        target = twistit.Event()
+        target.add_callback(lambda value:result.append((0, value)))
+        target.add_callback(lambda value:result.append((1, value)))
+        target.fire_many(iter([1, 2]))
+        self.assertEqual([(0, 1), (0, 2), (1, 1), (1, 2)], result)
+        
+    def test_fire_many_empty(self):
+        result = []
+        
+        target = twistit.Event()
+        target.add_callback(result.append)
+        d = target.next_event()
+        target.fire_many([])
+        self.assertEqual([], result)
+        self.assertFalse(d.called)
+        
+    def test_fire_many_next_event(self):
+        result = []
+        
+        target = twistit.Event()
+        target.next_event().addCallback(result.append)
+        target.fire_many([1, 2])
+        self.assertEqual([1], result)
+        
+    def test_batch_callback(self):
+        result = []
+        
+        target = twistit.Event()
+        target.add_batch_callback(result.append)
+        target.fire_many([1, 2])
+        target.fire(3)
+        self.assertEqual([[1, 2], [3]], result)
+        
+    def test_remove_batch_callback(self):
+        result = []
+        def cb(values):
+            result.append(values)
+        
+        target = twistit.Event()
+        target.add_batch_callback(cb)
+        target.remove_callback(cb)
+        target.fire_many([1, 2])
+        target.fire(3)
+        self.assertEqual([], result)
+        
+    def test_derive_chain(self):
+        result = []
+        
+        target = twistit.Event()
+        derived = target.derive(lambda x:x+1).derive(lambda x:2*x)
+        derived.add_callback(result.append)
+        target.fire(1)
+        self.assertEqual([4], result)
+        
+    def test_derive_chain_observed(self):
+        result = []
+        
+        target = twistit.Event()
+        intermediate = target.derive(lambda x:x+1)
+        intermediate.add_callback(lambda value:result.append((0, value)))
+        derived = intermediate.derive(lambda x:2*x)
+        derived.add_callback(lambda value:result.append((1, value)))
+        target.fire(1)
+        self.assertEqual([(0, 2), (1, 4)], result)
+        
+    def test_derive_not_observed(self):
+        calls = []
+        def modifier(value):
+            calls.append(value)
+            return value
+        
+        target = twistit.Event()
+        target.derive(modifier)
+        target.fire(1)
+        self.assertEqual([], calls)
+        
+    def test_derive_stops_observing(self):
+        result = []
+        
+        target = twistit.Event()
+        derived = target.derive(lambda x:2*x)
+        derived.add_callback(result.append)
+        derived.remove_callback(result.append)
+        target.fire(1)
+        target.fire(2)
+        derived.add_callback(result.append)
+        target.fire(3)
+        self.assertEqual([6], result)
+        
+    def test_derive_next_event(self):
+        result = []
+        
+        target = twistit.Event()
+        target.derive(lambda x:2*x).next_event().addCallback(result.append)
+        target.fire(1)
+        target.fire(2)
+        self.assertEqual([2], result)
+        
+    def test_map(self):
+        result = []
+        
+        target = twistit.Event()
+        target.map(lambda x:2*x).add_callback(result.append)
+        target.fire(1)
+        self.assertEqual([2], result)
+        
+    def test_filter(self):
+        result = []
+        
+        target = twistit.Event()
+        target.filter(lambda x:x % 2).map(lambda x:2*x).add_callback(result.append)
+        target.fire_many([1, 2, 3])
+        self.assertEqual([2, 6], result)
+        
+    def test_weak_method(self):
+        observer = Observer()
+        
+        target = twistit.Event()
+        target.add_callback(observer.cb, weak=True)
+        target.fire(42)
+        self.assertEqual([42], observer.result)
+        
+    def test_weak_method_collected(self):
+        observer = Observer()
+        
+        target = twistit.Event()
+        handle = target.add_callback(observer.cb, weak=True)
+        del observer
+        gc.collect()
+        target.fire(42)
+        self.assertRaises(ValueError, target.remove_callback, handle)
+        
+    def test_weak_function_collected(self):
+        result = []
+        def cb(value):
+            result.append(value)
+        
+        target = twistit.Event()
+        handle = target.add_callback(cb, weak=True)
+        del cb
+        gc.collect()
+        target.fire(42)
+        self.assertEqual([], result)
+        self.assertRaises(ValueError, target.remove_callback, handle)
+        
+    def test_weak_batch_collected(self):
+        observer = Observer()
+        
+        target = twistit.Event()
+        handle = target.add_batch_callback(observer.cb, weak=True)
+        target.fire_many([1, 2])
+        self.assertEqual([[1, 2]], observer.result)
+        del observer
+        gc.collect()
+        target.fire_many([1, 2])
+        self.assertRaises(ValueError, target.remove_callback, handle)
+        
+    def test_weak_remove(self):
+        observer = Observer()
+        
+        target = twistit.Event()
+        target.add_callback(observer.cb, weak=True)
+        target.remove_callback(observer.cb)
+        target.fire(42)
+        self.assertEqual([], observer.result)
+        
+    def test_fire_async_no_deferreds(self):
+        result = []
+        
+        target = twistit.Event()
+        target.add_callback(result.append)
+        d = target.fire_async(42)
+        self.assertEqual([42], result)
+        self.assertEqual(None, twistit.extract(d))
+        
+    def test_fire_async_waits(self):
+        pending = [defer.Deferred(), defer.Deferred()]
+        
+        target = twistit.Event()
+        target.add_callback(lambda value:pending[0])
+        target.add_callback(lambda value:pending[1])
+        d = target.fire_async(42)
+        pending[0].callback(None)
+        self.assertFalse(twistit.has_result(d))
+        pending[1].callback(None)
+        self.assertEqual(None, twistit.extract(d))
+        
+    def test_fire_async_failure(self):
+        pending = [defer.Deferred(), defer.Deferred()]
+        
+        target = twistit.Event()
+        target.add_callback(lambda value:pending[0])
+        target.add_callback(lambda value:pending[1])
+        d = target.fire_async(42)
+        pending[0].errback(ValueError())
+        self.assertFalse(twistit.has_result(d))
+        pending[1].callback(None)
+        self.assertRaises(ValueError, twistit.extract, d)
+        
+    def test_fire_async_raises(self):
+        pending = defer.Deferred()
+        result = []
+        def raises(value):
+            raise ValueError()
+        
+        target = twistit.Event()
+        target.add_callback(lambda value:pending)
+        target.add_callback(raises)
+        target.add_callback(result.append)
+        d = target.fire_async(42)
+        self.assertEqual([], result)
+        self.assertFalse(twistit.has_result(d))
+        pending.errback(KeyError())
+        self.assertRaises(KeyError, twistit.extract, d)
+        
+    def test_fire_async_raises_only(self):
+        def raises(value):
+            raise ValueError()
+        
+        target = twistit.Event()
+        target.add_callback(raises)
+        d = target.fire_async(42)
+        self.assertRaises(ValueError, twistit.extract, d)
+        
+    def test_bounded_fire(self):
+        pending = []
+        def cb(value):
+            d = defer.Deferred()
+            pending.append(d)
+            return d
+        
+        target = twistit.Event()
+        target.add_callback(cb)
+        fire = target.bounded_fire(2)
+        d0 = fire(0)
+        d1 = fire(1)
+        d2 = fire(2)
+        self.assertTrue(twistit.has_result(d0))
+        self.assertTrue(twistit.has_result(d1))
+        self.assertFalse(twistit.has_result(d2))
+        self.assertEqual(2, len(pending))
+        
+        pending[0].callback(None)
+        self.assertTrue(twistit.has_result(d2))
+        self.assertEqual(3, len(pending))
+        
+    def test_no_instance_dict(self):
+        target = twistit.Event()
+        self.assertFalse(hasattr(target, "__dict__"))
+        self.assertFalse(hasattr(target.derive(lambda x:x), "__dict__"))
+        
+    def test_remove_down_to_one(self):
+        result = []
+        
+        target = twistit.Event()
+        handle = target.add_callback(lambda value:result.append(0))
+        target.add_callback(lambda value:result.append(1))
+        target.remove_callback(handle)
+        target.fire(42)
+        target.add_callback(lambda value:result.append(2))
+        target.fire(43)
+        self.assertEqual([1, 1, 2], result)
+        
+    def test_remove_only_and_add(self):
+        result = []
+        
+        target = twistit.Event()
+        handle = target.add_callback(lambda value:result.append(0))
+        target.remove_callback(handle)
+        target.fire(42)
+        target.add_callback(lambda value:result.append(1))
+        target.fire(43)
+        self.assertEqual([1], result)
+        self.assertRaises(ValueError, target.remove_callback, handle)
+        
+    def test_coalesce(self):
+        result = []
+        clock = twistit.TimeMock()
+        
+        target = twistit.Event()
+        target.coalesce(clock).add_callback(result.append)
+        target.fire_many([1, 2, 3])
+        self.assertEqual([], result)
+        clock.advanceTime(0)
+        self.assertEqual([3], result)
+        target.fire(4)
+        clock.advanceTime(0)
+        self.assertEqual([3, 4], result)
+        
+    def test_throttle(self):
+        result = []
+        clock = twistit.TimeMock()
+        
+        target = twistit.Event()
+        target.throttle(1, clock).add_callback(result.append)
+        target.fire(1)
+        target.fire(2)
+        target.fire(3)
+        self.assertEqual([1], result)
+        clock.advanceTime(1)
+        self.assertEqual([1, 3], result)
+        target.fire(4)
+        clock.advanceTime(1)
+        self.assertEqual([1, 3, 4], result)
+        clock.advanceTime(1)
+        target.fire(5)
+        self.assertEqual([1, 3, 4, 5], result)
+        
+    def test_debounce(self):
+        result = []
+        clock = twistit.TimeMock()
+        
+        target = twistit.Event()
+        target.debounce(1, clock).add_callback(result.append)
+        target.fire(1)
+        clock.advanceTime(0.5)
+        target.fire(2)
+        clock.advanceTime(0.5)
+        self.assertEqual([], result)
+        clock.advanceTime(0.5)
+        self.assertEqual([2], result)
+        
+    def test_timed_unlinked(self):
+        result = []
+        clock = twistit.TimeMock()
+        
+        target = twistit.Event()
+        derived = target.debounce(1, clock)
+        handle = derived.add_callback(result.append)
+        target.fire(1)
+        derived.remove_callback(handle)
+        target.fire(2)
+        self.assertEqual((), clock.getDelayedCalls())
+        clock.advanceTime(1)
+        self.assertEqual([], result)
+        
+        derived.add_callback(result.append)
+        target.fire(3)
+        clock.advanceTime(1)
+        self.assertEqual([3], result)
+        
+    def test_throttle_after_map(self):
+        result = []
+        clock = twistit.TimeMock()
+        
+        target = twistit.Event()
+        derived = target.map(lambda x:2*x).throttle(1, clock).map(lambda x:x+1)
+        derived.add_callback(result.append)
+        target.fire(1)
+        target.fire(2)
+        clock.advanceTime(1)
+        self.assertEqual([3, 5], result)
+        
+    def test_stats(self):
+        timer = FakeTimer()
+        def cb0(value):
+            timer.now += value
+        def cb1(value):
+            raise ValueError()
+        
+        target = twistit.Event()
+        target.enable_stats(timer=timer)
+        target.add_callback(cb0)
+        target.fire(2)
+        target.fire(1)
+        target.add_callback(cb1)
+        self.assertRaises(ValueError, target.fire, 3)
+        
+        stats = target.get_stats()
+        self.assertEqual([twistit.ObserverStats(cb0, 3, 0, 6, 3),
+                          twistit.ObserverStats(cb1, 1, 1, 0, 0)], stats)
+        
+    def test_stats_fire_many(self):
+        timer = FakeTimer()
+        def cb(value):
+            timer.now += value
+        
+        target = twistit.Event()
+        target.enable_stats(timer=timer)
+        target.add_callback(cb)
+        target.fire_many([1, 2])
+        self.assertEqual([twistit.ObserverStats(cb, 1, 0, 3, 3)], 
+                         target.get_stats())
+        
+    def test_stats_disabled(self):
+        target = twistit.Event()
+        target.add_callback(lambda value:None)
+        target.fire(42)
+        self.assertEqual([], target.get_stats())
+        target.enable_stats()
+        target.disable_stats()
+        target.fire(42)
+        self.assertEqual([], target.get_stats())
+        
+    def test_stats_budget(self):
+        timer = FakeTimer()
+        def cb(value):
+            timer.now += value
+        
+        target = twistit.Event()
+        target.enable_stats(budget=1, timer=timer)
+        target.add_callback(cb)
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger("twistit._events")
+        logger.addHandler(handler)
+        try:
+            target.fire(1)
+            self.assertEqual(0, len(records))
+            target.fire(2)
+            self.assertEqual(1, len(records))
+        finally:
+            logger.removeHandler(handler)
+        
+class FakeTimer(object):
+    
+    def __init__(self):
+        self.now = 0
+        
+    def __call__(self):
+        return self.now
+        
+class Observer(object):
+    
+    def __init__(self):
+        self.result = []
+    
+    def cb(self, value):
+        self.result.append(value)
@@ -0,0 +1,214 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+import twistit
+
+from twisted.internet import defer
+
+class Function(object):
+    """
+    Stand-in for the memoized function. Each call returns a new
+    deferred that the test fires.
+    """
+    
+    def __init__(self):
+        self.calls = []
+        self.cancelled = []
+        
+    def __call__(self, *args, **kwargs):
+        d = defer.Deferred(self.cancelled.append)
+        self.calls.append(((args, kwargs), d))
+        return d
+    
+    
+class TestMemoize(unittest.TestCase):
+    """
+    Unit tests for :func:`twistit.memoize`.
+    """
+    
+    def setUp(self):
+        self.function = Function()
+        self.clock = twistit.TimeMock()
+        
+    def test_single_call(self):
+        f = twistit.memoize(self.function)
+        d = f(1, x=2)
+        self.assertEqual([((1,), {"x":2})], [args for args, _ in self.function.calls])
+        self.function.calls[0][1].callback("result")
+        self.assertEqual("result", twistit.extract(d))
+        
+    def test_concurrent_calls_shared(self):
+        f = twistit.memoize(self.function)
+        d1 = f(1)
+        d2 = f(1)
+        self.assertEqual(1, len(self.function.calls))
+        self.assertIsNot(d1, d2)
+        self.function.calls[0][1].callback("result")
+        self.assertEqual("result", twistit.extract(d1))
+        self.assertEqual("result", twistit.extract(d2))
+        
+    def test_different_arguments_not_shared(self):
+        f = twistit.memoize(self.function)
+        f(1)
+        f(2)
+        f(1, x=1)
+        self.assertEqual(3, len(self.function.calls))
+        
+    def test_no_cache_by_default(self):
+        f = twistit.memoize(self.function)
+        f(1)
+        self.function.calls[0][1].callback("result")
+        f(1)
+        self.assertEqual(2, len(self.function.calls))
+        
+    def test_failure_delivered_to_all(self):
+        f = twistit.memoize(self.function)
+        d1 = f(1)
+        d2 = f(1)
+        self.function.calls[0][1].errback(ValueError())
+        self.assertTrue(twistit.extract_failure(d1).check(ValueError))
+        self.assertTrue(twistit.extract_failure(d2).check(ValueError))
+        
+    def test_synchronous_result(self):
+        f = twistit.memoize(lambda x: x * 2)
+        self.assertEqual(4, twistit.extract(f(2)))
+        self.assertEqual(4, twistit.extract(f(2)))
+        
+    def test_unhashable_not_shared(self):
+        f = twistit.memoize(self.function)
+        f([1])
+        f([1])
+        self.assertEqual(2, len(self.function.calls))
+        f(1, x=[1])
+        f(1, x=[1])
+        self.assertEqual(4, len(self.function.calls))
+        
+    def test_cancel_one_caller(self):
+        f = twistit.memoize(self.function)
+        d1 = f(1)
+        d2 = f(1)
+        d1.cancel()
+        self.assertTrue(twistit.extract_failure(d1).check(defer.CancelledError))
+        self.assertEqual([], self.function.cancelled)
+        self.function.calls[0][1].callback("result")
+        self.assertEqual("result", twistit.extract(d2))
+        
+    def test_cancel_all_callers(self):
+        f = twistit.memoize(self.function)
+        d1 = f(1)
+        d2 = f(1)
+        d1.cancel()
+        d2.cancel()
+        self.assertEqual(1, len(self.function.cancelled))
+        self.assertTrue(twistit.extract_failure(d1).check(defer.CancelledError))
+        self.assertTrue(twistit.extract_failure(d2).check(defer.CancelledError))
+        
+    def test_call_after_cancel_starts_new(self):
+        calls = []
+        def function(x):
+            d = defer.Deferred()
+            calls.append(d)
+            return d
+        f = twistit.memoize(function)
+        d = f(1)
+        d.cancel()
+        twistit.extract_failure(d)
+        d = f(1)
+        self.assertEqual(2, len(calls))
+        calls[1].callback("result")
+        self.assertEqual("result", twistit.extract(d))
+        
+    def test_cache(self):
+        f = twistit.memoize(cache_size=10)(self.function)
+        f(1)
+        self.function.calls[0][1].callback("result")
+        d = f(1)
+        self.assertEqual(1, len(self.function.calls))
+        self.assertEqual("result", twistit.extract(d))
+        
+    def test_failures_not_cached(self):
+        f = twistit.memoize(cache_size=10)(self.function)
+        d = f(1)
+        self.function.calls[0][1].errback(ValueError())
+        twistit.extract_failure(d)
+        f(1)
+        self.assertEqual(2, len(self.function.calls))
+        
+    def test_cache_least_recently_used(self):
+        f = twistit.memoize(cache_size=2)(self.function)
+        for x in [1, 2]:
+            f(x)
+            self.function.calls[-1][1].callback(x)
+        f(1)
+        f(3)
+        self.function.calls[-1][1].callback(3)
+        self.assertEqual(3, len(self.function.calls))
+        f(1)
+        f(3)
+        self.assertEqual(3, len(self.function.calls))
+        f(2)
+        self.assertEqual(4, len(self.function.calls))
+        
+    def test_ttl(self):
+        f = twistit.memoize(cache_size=10, ttl=5, clock=self.clock)(self.function)
+        f(1)
+        self.function.calls[0][1].callback("result")
+        self.clock.advanceTime(4)
+        self.assertEqual("result", twistit.extract(f(1)))
+        self.assertEqual(1, len(self.function.calls))
+        self.clock.advanceTime(1)
+        f(1)
+        self.assertEqual(2, len(self.function.calls))
+        
+    def test_ttl_without_cache(self):
+        self.assertRaises(ValueError, twistit.memoize, ttl=5, clock=self.clock)
+        
+    def test_positional_options(self):
+        self.assertRaises(TypeError, twistit.memoize, 100)
+        
+    def test_method(self):
+        class Service(object):
+            def __init__(self):
+                self.calls = 0
+            @twistit.memoize(cache_size=1)
+            def get(self, x):
+                self.calls += 1
+                return x
+        service = Service()
+        self.assertEqual(3, twistit.extract(service.get(3)))
+        self.assertEqual(3, twistit.extract(service.get(3)))
+        self.assertEqual(1, service.calls)
+        
+    def test_with_yieldefer(self):
+        started = []
+        @twistit.memoize
+        @twistit.yieldefer
+        def function(x):
+            d = defer.Deferred()
+            started.append(d)
+            value = yield d
+            defer.returnValue(value + x)
+        d1 = function(1)
+        d2 = function(1)
+        self.assertEqual(1, len(started))
+        started[0].callback(10)
+        self.assertEqual(11, twistit.extract(d1))
+        self.assertEqual(11, twistit.extract(d2))
@@ -0,0 +1,199 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+import twistit
+
+from twisted.internet import defer
+
+class Function(object):
+    """
+    Stand-in for the retried function. Each call returns a new
+    deferred that the test fires.
+    """
+    
+    def __init__(self):
+        self.calls = []
+        self.cancelled = []
+        
+    def __call__(self, *args, **kwargs):
+        d = defer.Deferred(self.cancelled.append)
+        self.calls.append(d)
+        return d
+    
+    def fail(self, error=None):
+        self.calls[-1].errback(error or ValueError())
+    
+    
+class TestRetry(unittest.TestCase):
+    """
+    Unit tests for :func:`twistit.retry`.
+    """
+    
+    def setUp(self):
+        self.function = Function()
+        self.clock = twistit.TimeMock()
+        
+    def retry(self, **kwargs):
+        kwargs.setdefault("jitter", 0)
+        kwargs.setdefault("clock", self.clock)
+        return twistit.retry(**kwargs)(self.function)
+        
+    def test_success(self):
+        d = self.retry()("a", b=1)
+        self.function.calls[0].callback(42)
+        self.assertEqual(42, twistit.extract(d))
+        
+    def test_arguments(self):
+        args = []
+        f = twistit.retry(lambda *a, **kw: args.append((a, kw)), clock=self.clock)
+        f(1, x=2)
+        self.assertEqual([((1,), {"x":2})], args)
+        
+    def test_positional_options(self):
+        self.assertRaises(TypeError, twistit.retry, 5)
+        
+    def test_retry_after_delay(self):
+        d = self.retry(delay=1)()
+        self.function.fail()
+        self.assertEqual(1, len(self.function.calls))
+        self.clock.advanceTime(0.9)
+        self.assertEqual(1, len(self.function.calls))
+        self.clock.advanceTime(0.1)
+        self.assertEqual(2, len(self.function.calls))
+        self.function.calls[1].callback(42)
+        self.assertEqual(42, twistit.extract(d))
+        
+    def test_backoff(self):
+        self.retry(attempts=5, delay=1, factor=3, max_delay=5)()
+        times = []
+        for _ in range(4):
+            self.function.fail()
+            calls = len(self.function.calls)
+            start = self.clock.seconds()
+            while len(self.function.calls) == calls:
+                self.clock.advanceTime(0.5)
+            times.append(self.clock.seconds() - start)
+        self.assertEqual([1, 3, 5, 5], times)
+        
+    def test_jitter(self):
+        self.retry(delay=10, jitter=0.5)()
+        self.function.fail()
+        self.clock.advanceTime(4.9)
+        self.assertEqual(1, len(self.function.calls))
+        self.clock.advanceTime(5.1)
+        self.assertEqual(2, len(self.function.calls))
+        
+    def test_attempts_exhausted(self):
+        d = self.retry(attempts=2)()
+        self.function.fail()
+        self.clock.advanceTime(1)
+        self.function.fail(KeyError())
+        self.assertEqual(2, len(self.function.calls))
+        self.assertTrue(twistit.extract_failure(d).check(KeyError))
+        
+    def test_retry_on(self):
+        d = self.retry(retry_on=(KeyError,))()
+        self.function.fail(ValueError())
+        self.assertEqual(1, len(self.function.calls))
+        self.assertTrue(twistit.extract_failure(d).check(ValueError))
+        
+    def test_budget(self):
+        budget = twistit.RetryBudget(ratio=0.5, capacity=1)
+        f = self.retry(attempts=10, budget=budget)
+        d = f()
+        self.function.fail()
+        self.clock.advanceTime(1)
+        self.function.fail()
+        self.clock.advanceTime(1)
+        self.assertEqual(2, len(self.function.calls))
+        twistit.extract_failure(d)
+        
+        d = f()
+        self.function.fail()
+        self.assertTrue(twistit.extract_failure(d).check(ValueError))
+        self.assertEqual(3, len(self.function.calls))
+        
+        f()
+        self.function.fail()
+        self.clock.advanceTime(1)
+        self.assertEqual(5, len(self.function.calls))
+        
+    def test_cancel_attempt(self):
+        d = self.retry()()
+        d.cancel()
+        self.assertEqual(1, len(self.function.cancelled))
+        self.assertTrue(twistit.extract_failure(d).check(defer.CancelledError))
+        self.clock.advanceTime(10)
+        self.assertEqual(1, len(self.function.calls))
+        
+    def test_cancel_wait(self):
+        d = self.retry()()
+        self.function.fail()
+        d.cancel()
+        self.assertTrue(twistit.extract_failure(d).check(defer.CancelledError))
+        self.assertEqual((), self.clock.getDelayedCalls())
+        self.clock.advanceTime(10)
+        self.assertEqual(1, len(self.function.calls))
+        
+    def test_timeout(self):
+        d = self.retry(attempts=2, delay=1, timeout=5)()
+        self.clock.advanceTime(5)
+        self.assertEqual(1, len(self.function.cancelled))
+        self.clock.advanceTime(1)
+        self.assertEqual(2, len(self.function.calls))
+        self.clock.advanceTime(4.9)
+        self.assertFalse(d.called)
+        self.clock.advanceTime(0.1)
+        self.assertEqual(2, len(self.function.cancelled))
+        self.assertTrue(twistit.extract_failure(d).check(twistit.TimeoutError))
+        
+    def test_yieldefer(self):
+        attempts = []
+        @twistit.retry(clock=self.clock, jitter=0)
+        @twistit.yieldefer
+        def function():
+            attempts.append(None)
+            value = yield defer.succeed(len(attempts))
+            if value < 3:
+                raise ValueError()
+            defer.returnValue(value)
+        d = function()
+        self.clock.advanceTime(1)
+        self.assertEqual(3, twistit.extract(d))
+        
+    def test_adaptive_timeout(self):
+        policy = twistit.AdaptiveTimeout(initial=5, clock=self.clock)
+        d = self.retry(attempts=2, delay=1, timeout=policy)()
+        self.clock.advanceTime(5)
+        self.assertEqual(1, len(self.function.cancelled))
+        self.clock.advanceTime(1)
+        self.function.calls[1].callback(42)
+        self.assertEqual(42, twistit.extract(d))
+        self.assertEqual(2, policy._sketch.count)
+        
+    def test_adaptive_timeout_retry_clock(self):
+        policy = twistit.AdaptiveTimeout(initial=10, min_samples=1, 
+                                         percentile=0.5)
+        d = self.retry(timeout=policy)()
+        self.clock.advanceTime(3)
+        self.function.calls[0].callback(42)
+        self.assertEqual(42, twistit.extract(d))
+        self.assertAlmostEqual(6, policy.timeout(), delta=0.3)
@@ -0,0 +1,82 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+import random
+import twistit
+
+class TestQuantileSketch(unittest.TestCase):
+    """
+    Unit tests for :class:`twistit.QuantileSketch`.
+    """
+    
+    def assertClose(self, expected, actual, accuracy=0.05):
+        self.assertTrue(abs(actual - expected) <= accuracy * expected, 
+                        "%s is not close to %s" % (actual, expected))
+    
+    def test_empty(self):
+        self.assertIsNone(twistit.QuantileSketch().quantile(0.5))
+        
+    def test_single(self):
+        sketch = twistit.QuantileSketch()
+        sketch.add(0.25)
+        for q in [0, 0.5, 1]:
+            self.assertClose(0.25, sketch.quantile(q))
+            
+    def test_uniform(self):
+        sketch = twistit.QuantileSketch(window=1e9)
+        values = [i / 1000.0 for i in range(1, 1001)]
+        random.Random(0).shuffle(values)
+        for value in values:
+            sketch.add(value)
+        self.assertEqual(1000, sketch.count)
+        self.assertClose(0.5, sketch.quantile(0.5))
+        self.assertClose(0.99, sketch.quantile(0.99))
+        self.assertClose(1.0, sketch.quantile(1))
+        
+    def test_range(self):
+        sketch = twistit.QuantileSketch(minimum=0.01, maximum=10)
+        sketch.add(0.001)
+        self.assertEqual(0.01, sketch.quantile(0.5))
+        sketch = twistit.QuantileSketch(minimum=0.01, maximum=10)
+        sketch.add(1000)
+        self.assertClose(10, sketch.quantile(0.5))
+        
+    def test_bounded_memory(self):
+        sketch = twistit.QuantileSketch()
+        size = len(sketch._counts)
+        for i in range(1, 10000):
+            sketch.add(i * 0.001)
+        self.assertEqual(size, len(sketch._counts))
+        
+    def test_window(self):
+        sketch = twistit.QuantileSketch(window=100)
+        for _ in range(1000):
+            sketch.add(1.0)
+        for _ in range(1000):
+            sketch.add(0.1)
+        self.assertClose(0.1, sketch.quantile(0.99))
+        
+    def test_rescale(self):
+        sketch = twistit.QuantileSketch(window=1)
+        for _ in range(1000):
+            sketch.add(1.0)
+        self.assertTrue(sketch._weight < 1e100)
+        self.assertClose(1.0, sketch.quantile(0.5))
@@ -24,6 +24,11 @@ import utwist
 
 from twisted.internet import defer, task, reactor
 
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
 class TestTimeout(unittest.TestCase):
     
     def test_immediate(self):
@@ -63,6 +68,390 @@ class TestTimeout(unittest.TestCase):
         yield task.deferLater(reactor, 0.1, d.callback, 42)
         self.assertEqual(42, extract_deferred(d))
         
+    def test_clock_timeout(self):
+        clock = twistit.TimeMock()
+        d = twistit.timeout_deferred(defer.Deferred(), 10, clock=clock)
+        clock.advanceTime(9)
+        self.assertFalse(d.called)
+        clock.advanceTime(1)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        
+    def test_clock_result(self):
+        clock = twistit.TimeMock()
+        d = defer.Deferred()
+        twistit.timeout_deferred(d, 10, clock=clock)
+        d.callback(42)
+        self.assertEqual((), clock.getDelayedCalls())
+        self.assertEqual(42, extract_deferred(d))
+        
+    def test_error_message(self):
+        clock = twistit.TimeMock()
+        d = twistit.timeout_deferred(defer.Deferred(), 1, "too slow", clock)
+        clock.advanceTime(1)
+        self.assertEqual("too slow", twistit.extract_failure(d).value.value)
+        
+    def test_reactor_imported_late(self):
+        from twistit import _timeout
+        self.assertFalse(hasattr(_timeout, "reactor"))
+        
+class TestTimeoutGroup(unittest.TestCase):
+    """
+    Unit tests for :class:`twistit.TimeoutGroup`.
+    """
+    
+    def setUp(self):
+        self.clock = twistit.TimeMock()
+        self.group = twistit.TimeoutGroup(tolerance=1, clock=self.clock)
+        
+    def timeout(self, timeout, d=None):
+        d = d if d is not None else defer.Deferred()
+        return self.group.timeout_deferred(d, timeout)
+    
+    def test_timeout(self):
+        d = self.timeout(5)
+        self.clock.advanceTime(4.9)
+        self.assertFalse(d.called)
+        self.clock.advanceTime(0.1)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        
+    def test_rounded_up(self):
+        d = self.timeout(4.5)
+        self.clock.advanceTime(4.9)
+        self.assertFalse(d.called)
+        self.clock.advanceTime(0.1)
+        self.assertTrue(d.called)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        
+    def test_shared_timer(self):
+        ds = [self.timeout(5)]
+        self.clock.advanceTime(0.3)
+        ds.append(self.timeout(4.5))
+        ds.append(self.timeout(4.6))
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advanceTime(4.7)
+        for d in ds:
+            self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+            
+    def test_separate_timers(self):
+        d1 = self.timeout(1)
+        d2 = self.timeout(3)
+        self.assertEqual(2, len(self.clock.getDelayedCalls()))
+        self.clock.advanceTime(1)
+        self.assertTrue(d1.called)
+        self.assertFalse(d2.called)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d1)
+        
+    def test_result(self):
+        d1 = self.timeout(5)
+        d2 = self.timeout(5)
+        d1.callback(1)
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        d2.callback(2)
+        self.assertEqual((), self.clock.getDelayedCalls())
+        self.assertEqual(1, extract_deferred(d1))
+        self.assertEqual(2, extract_deferred(d2))
+        
+    def test_some_pending(self):
+        d1 = self.timeout(5)
+        d2 = self.timeout(5)
+        d1.callback(1)
+        self.clock.advanceTime(5)
+        self.assertEqual(1, extract_deferred(d1))
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d2)
+        
+    def test_reused_after_result(self):
+        self.timeout(5).callback(None)
+        d = self.timeout(5)
+        self.clock.advanceTime(5)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        
+    def test_error_message(self):
+        d = self.group.timeout_deferred(defer.Deferred(), 1, "too slow")
+        self.clock.advanceTime(1)
+        self.assertEqual("too slow", twistit.extract_failure(d).value.value)
+        
+    def test_none(self):
+        d = self.timeout(None)
+        self.assertEqual((), self.clock.getDelayedCalls())
+        d.callback(42)
+        self.assertEqual(42, extract_deferred(d))
+        
+    @unittest.skipIf(contextvars is None, "Requires Python 3.7")
+    def test_none_deadline(self):
+        with twistit.Deadline(2, self.clock):
+            d = self.timeout(None)
+        self.clock.advanceTime(2)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        
+    def test_zero(self):
+        d = self.timeout(0)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        self.assertEqual({}, self.group._timeouts)
+        
+    @unittest.skipIf(contextvars is None, "Requires Python 3.7")
+    def test_deadline(self):
+        with twistit.Deadline(2, self.clock):
+            d = self.timeout(5)
+        self.clock.advanceTime(2)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        
+class TestAdaptiveTimeout(unittest.TestCase):
+    """
+    Unit tests for :class:`twistit.AdaptiveTimeout`.
+    """
+    
+    def setUp(self):
+        self.clock = twistit.TimeMock()
+        
+    def policy(self, **kwargs):
+        kwargs.setdefault("initial", 10)
+        kwargs.setdefault("min_samples", 5)
+        kwargs.setdefault("clock", self.clock)
+        return twistit.AdaptiveTimeout(**kwargs)
+    
+    def call(self, policy, latency):
+        d = twistit.timeout_deferred(defer.Deferred(), policy, clock=self.clock)
+        self.clock.advanceTime(latency)
+        if not d.called:
+            d.callback(None)
+        return d
+        
+    def test_initial(self):
+        policy = self.policy()
+        self.assertEqual(10, policy.timeout())
+        for _ in range(4):
+            policy.record(1)
+        self.assertEqual(10, policy.timeout())
+        
+    def test_percentile(self):
+        policy = self.policy(percentile=0.5, multiplier=3)
+        for _ in range(5):
+            policy.record(1)
+        self.assertAlmostEqual(3, policy.timeout(), delta=0.15)
+        
+    def test_limits(self):
+        policy = self.policy(minimum=2, maximum=5)
+        for _ in range(5):
+            policy.record(0.1)
+        self.assertEqual(2, policy.timeout())
+        for _ in range(100):
+            policy.record(100)
+        self.assertEqual(5, policy.timeout())
+        
+    def test_follows_latencies(self):
+        policy = self.policy(window=50)
+        for _ in range(200):
+            self.call(policy, 1)
+        self.assertAlmostEqual(2, policy.timeout(), delta=0.1)
+        for _ in range(500):
+            self.call(policy, 0.1)
+        self.assertAlmostEqual(0.2, policy.timeout(), delta=0.01)
+        
+    def test_timeout(self):
+        policy = self.policy()
+        d = self.call(policy, 10)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        
+    def test_timeouts_count(self):
+        policy = self.policy(min_samples=1, multiplier=1, percentile=0.5)
+        self.call(policy, 1)
+        d = self.call(policy, 5)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        self.assertEqual(2, policy._sketch.count)
+        
+    def test_clock_of_timeout(self):
+        policy = twistit.AdaptiveTimeout(initial=10, min_samples=1, 
+                                         percentile=0.5)
+        self.call(policy, 3)
+        self.assertAlmostEqual(6, policy.timeout(), delta=0.3)
+        d = self.call(policy, 3)
+        self.assertEqual(None, extract_deferred(d))
+        
+    def test_clock_of_policy(self):
+        policy = twistit.AdaptiveTimeout(initial=5, clock=self.clock)
+        d = twistit.timeout_deferred(defer.Deferred(), policy)
+        self.clock.advanceTime(4.9)
+        self.assertFalse(d.called)
+        self.clock.advanceTime(0.1)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        self.assertEqual(1, policy._sketch.count)
+        
+    def test_clock_of_group(self):
+        policy = twistit.AdaptiveTimeout(initial=10, min_samples=1, 
+                                         percentile=0.5)
+        group = twistit.TimeoutGroup(tolerance=1, clock=self.clock)
+        d = group.timeout_deferred(defer.Deferred(), policy)
+        self.clock.advanceTime(3)
+        d.callback(None)
+        self.assertAlmostEqual(6, policy.timeout(), delta=0.3)
+        
+    def test_failures_ignored(self):
+        policy = self.policy()
+        d = twistit.timeout_deferred(defer.Deferred(), policy, clock=self.clock)
+        d.errback(ValueError())
+        self.assertRaises(ValueError, extract_deferred, d)
+        self.assertEqual(0, policy._sketch.count)
+        
+    def test_group(self):
+        policy = self.policy()
+        group = twistit.TimeoutGroup(tolerance=1, clock=self.clock)
+        d = group.timeout_deferred(defer.Deferred(), policy)
+        self.clock.advanceTime(10)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        self.assertEqual(1, policy._sketch.count)
+        
+    @unittest.skipIf(contextvars is None, "Requires Python 3.7")
+    def test_deadline_timeouts_ignored(self):
+        policy = self.policy()
+        with twistit.Deadline(1, self.clock):
+            d = twistit.timeout_deferred(defer.Deferred(), policy)
+        self.clock.advanceTime(1)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        self.assertEqual(0, policy._sketch.count)
+        
+@unittest.skipIf(contextvars is None, "Requires Python 3.7")
+class TestDeadline(unittest.TestCase):
+    """
+    Unit tests for :class:`twistit.Deadline`.
+    """
+    
+    def setUp(self):
+        self.clock = twistit.TimeMock()
+        
+    def timeout(self, timeout, d=None):
+        d = d if d is not None else defer.Deferred()
+        return twistit.timeout_deferred(d, timeout, clock=self.clock)
+    
+    def assertTimedOut(self, d):
+        self.assertTrue(d.called)
+        self.assertRaises(twistit.TimeoutError, extract_deferred, d)
+        
+    def test_remaining(self):
+        with twistit.Deadline(2, self.clock) as deadline:
+            self.clock.advanceTime(0.5)
+            self.assertEqual(1.5, deadline.remaining())
+        
+    def test_remaining_before_enter(self):
+        deadline = twistit.Deadline(2, self.clock)
+        self.assertRaises(RuntimeError, deadline.remaining)
+        
+    def test_clamped(self):
+        with twistit.Deadline(2, self.clock):
+            d = self.timeout(5)
+        self.clock.advanceTime(1.9)
+        self.assertFalse(d.called)
+        self.clock.advanceTime(0.1)
+        self.assertTimedOut(d)
+        
+    def test_shorter_timeout(self):
+        with twistit.Deadline(5, self.clock):
+            d = self.timeout(1)
+        self.clock.advanceTime(1)
+        self.assertTimedOut(d)
+        
+    def test_only_deadline(self):
+        with twistit.Deadline(2, self.clock):
+            d = self.timeout(None)
+        self.clock.advanceTime(2)
+        self.assertTimedOut(d)
+        
+    def test_no_deadline(self):
+        d = self.timeout(None)
+        self.assertEqual((), self.clock.getDelayedCalls())
+        d.callback(42)
+        self.assertEqual(42, extract_deferred(d))
+        
+    def test_shared_timer(self):
+        with twistit.Deadline(2, self.clock):
+            ds = [self.timeout(5) for _ in range(3)]
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advanceTime(2)
+        for d in ds:
+            self.assertTimedOut(d)
+            
+    def test_result(self):
+        with twistit.Deadline(2, self.clock):
+            d1 = self.timeout(5)
+            d2 = self.timeout(5)
+        d1.callback(1)
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        d2.callback(2)
+        self.assertEqual((), self.clock.getDelayedCalls())
+        self.assertEqual(1, extract_deferred(d1))
+        self.assertEqual(2, extract_deferred(d2))
+        
+    def test_failure(self):
+        with twistit.Deadline(2, self.clock):
+            d = self.timeout(5)
+        d.errback(ValueError())
+        self.assertRaises(ValueError, extract_deferred, d)
+        
+    def test_already_called(self):
+        with twistit.Deadline(2, self.clock):
+            d = self.timeout(5, defer.succeed(42))
+        self.assertEqual((), self.clock.getDelayedCalls())
+        self.assertEqual(42, extract_deferred(d))
+        
+    def test_expired(self):
+        with twistit.Deadline(2, self.clock):
+            self.clock.advanceTime(3)
+            d = self.timeout(5)
+            self.assertTimedOut(d)
+        self.assertEqual((), self.clock.getDelayedCalls())
+        
+    def test_after_exit(self):
+        with twistit.Deadline(2, self.clock):
+            pass
+        d = self.timeout(5)
+        self.clock.advanceTime(4)
+        self.assertFalse(d.called)
+        
+    def test_nested_longer(self):
+        with twistit.Deadline(2, self.clock):
+            with twistit.Deadline(5) as inner:
+                self.assertEqual(2, inner.remaining())
+                d = self.timeout(5)
+        self.clock.advanceTime(2)
+        self.assertTimedOut(d)
+        
+    def test_nested_shorter(self):
+        with twistit.Deadline(5, self.clock):
+            with twistit.Deadline(1):
+                d1 = self.timeout(10)
+            d2 = self.timeout(10)
+        self.clock.advanceTime(1)
+        self.assertTimedOut(d1)
+        self.assertFalse(d2.called)
+        self.clock.advanceTime(4)
+        self.assertTimedOut(d2)
+        
+    def test_yieldefer_inherits(self):
+        step = defer.Deferred()
+        
+        @twistit.yieldefer
+        def child():
+            yield self.timeout(10)
+            
+        @twistit.yieldefer
+        def parent():
+            with twistit.Deadline(2, self.clock):
+                yield step
+                yield child()
+                
+        d = parent()
+        other = child()
+        step.callback(None)
+        self.clock.advanceTime(2)
+        self.assertTimedOut(d)
+        self.assertFalse(other.called)
+        
+@unittest.skipIf(contextvars is not None, "Requires Python without contextvars")
+class TestDeadlineUnsupported(unittest.TestCase):
+    
+    def test_enter(self):
+        deadline = twistit.Deadline(2, twistit.TimeMock())
+        self.assertRaises(RuntimeError, deadline.__enter__)
+        
 def extract_deferred(d):
     if not d.called:
         raise ValueError("Deferred has not yet been called")
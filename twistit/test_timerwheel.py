@@ -0,0 +1,183 @@
+# Copyright (c) 2014 Stefan C. Mueller
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER 
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING 
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+import logging
+import twistit
+
+from twisted.internet import defer, error
+
+class TestTimerWheel(unittest.TestCase):
+    """
+    Unit tests for :class:`twistit.TimerWheel`.
+    """
+    
+    def setUp(self):
+        self.clock = twistit.TimeMock()
+        self.wheel = twistit.TimerWheel(tick=1, slots=8, clock=self.clock)
+        self.calls = []
+        
+    def call_later(self, delay, name):
+        return self.wheel.callLater(delay, self.calls.append, name)
+        
+    def test_seconds(self):
+        self.clock.advanceTime(3.5)
+        self.assertEqual(3.5, self.wheel.seconds())
+        
+    def test_call(self):
+        self.call_later(3, "a")
+        self.clock.advanceTime(2.9)
+        self.assertEqual([], self.calls)
+        self.clock.advanceTime(0.1)
+        self.assertEqual(["a"], self.calls)
+        
+    def test_rounded_up_to_tick(self):
+        self.call_later(2.5, "a")
+        self.clock.advanceTime(2.9)
+        self.assertEqual([], self.calls)
+        self.clock.advanceTime(0.1)
+        self.assertEqual(["a"], self.calls)
+        
+    def test_zero_delay(self):
+        self.call_later(0, "a")
+        self.assertEqual([], self.calls)
+        self.clock.advanceTime(1)
+        self.assertEqual(["a"], self.calls)
+        
+    def test_order(self):
+        self.call_later(2.5, "b")
+        self.call_later(2.2, "a")
+        self.call_later(1, "c")
+        self.clock.advanceTime(1)
+        self.assertEqual(["c"], self.calls)
+        self.clock.advanceTime(2)
+        self.assertEqual(["c", "a", "b"], self.calls)
+        
+    def test_more_than_one_round(self):
+        self.call_later(20, "a")
+        self.call_later(4, "b")
+        self.clock.advanceTime(19)
+        self.assertEqual(["b"], self.calls)
+        self.clock.advanceTime(1)
+        self.assertEqual(["b", "a"], self.calls)
+        
+    def test_late_tick(self):
+        self.call_later(2, "a")
+        self.call_later(30, "b")
+        self.clock._seconds = 100
+        self.clock.advanceTime(0)
+        self.assertEqual(["a", "b"], self.calls)
+        
+    def test_cancel(self):
+        call = self.call_later(3, "a")
+        call.cancel()
+        self.assertFalse(call.active())
+        self.clock.advanceTime(5)
+        self.assertEqual([], self.calls)
+        self.assertRaises(error.AlreadyCancelled, call.cancel)
+        
+    def test_cancel_after_call(self):
+        call = self.call_later(1, "a")
+        self.clock.advanceTime(1)
+        self.assertRaises(error.AlreadyCalled, call.cancel)
+        
+    def test_idle_stops(self):
+        self.call_later(1, "a").cancel()
+        self.call_later(2, "b")
+        self.clock.advanceTime(2)
+        self.assertEqual((), self.clock.getDelayedCalls())
+        
+    def test_idle_then_call(self):
+        self.call_later(1, "a")
+        self.clock.advanceTime(50)
+        self.call_later(2, "b")
+        self.clock.advanceTime(1)
+        self.assertEqual(["a"], self.calls)
+        self.clock.advanceTime(1)
+        self.assertEqual(["a", "b"], self.calls)
+        
+    def test_reset(self):
+        call = self.call_later(2, "a")
+        self.clock.advanceTime(1)
+        call.reset(5)
+        self.assertEqual(6, call.getTime())
+        self.clock.advanceTime(4)
+        self.assertEqual([], self.calls)
+        self.clock.advanceTime(1)
+        self.assertEqual(["a"], self.calls)
+        
+    def test_delay(self):
+        call = self.call_later(2, "a")
+        call.delay(1)
+        self.clock.advanceTime(2)
+        self.assertEqual([], self.calls)
+        self.clock.advanceTime(1)
+        self.assertEqual(["a"], self.calls)
+        
+    def test_cancel_from_call(self):
+        second = []
+        def first():
+            second[0].cancel()
+        self.wheel.callLater(1, first)
+        second.append(self.call_later(1.5, "b"))
+        self.clock.advanceTime(2)
+        self.assertEqual([], self.calls)
+        
+    def test_failing_call(self):
+        def fail():
+            raise ValueError()
+        self.wheel.callLater(1, fail)
+        self.call_later(1, "a")
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger("twistit._timerwheel")
+        logger.addHandler(handler)
+        try:
+            self.clock.advanceTime(1)
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(1, len(records))
+        self.assertEqual(["a"], self.calls)
+        
+    def test_get_delayed_calls(self):
+        a = self.call_later(1, "a")
+        b = self.call_later(10, "b")
+        self.assertEqual(set([a, b]), set(self.wheel.getDelayedCalls()))
+        
+    def test_fractional_tick(self):
+        wheel = twistit.TimerWheel(tick=0.1, clock=self.clock)
+        wheel.callLater(0.3, self.calls.append, "a")
+        for _ in range(10):
+            self.clock.advanceTime(0.1)
+        self.assertEqual(["a"], self.calls)
+        self.assertEqual((), self.clock.getDelayedCalls())
+        
+    def test_timeout_deferred(self):
+        d = twistit.timeout_deferred(defer.Deferred(), 2, clock=self.wheel)
+        self.clock.advanceTime(2)
+        self.assertTrue(twistit.extract_failure(d).check(twistit.TimeoutError))
+        
+    def test_timeout_deferred_result(self):
+        d = defer.Deferred()
+        twistit.timeout_deferred(d, 2, clock=self.wheel)
+        d.callback(42)
+        self.assertEqual((), self.wheel.getDelayedCalls())
+        self.assertEqual(42, twistit.extract(d))
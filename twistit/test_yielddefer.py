@@ -19,9 +19,18 @@
 # IN THE SOFTWARE.
 
 import unittest
+import sys
+import textwrap
 import twistit
 import traceback
-import StringIO as stringio
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
             
 from twisted.internet import defer
 from twisted.python import failure
@@ -95,6 +104,47 @@ class TestYieldDefer(unittest.TestCase):
         self.assertEqual(42, extract_deferred(d))
         
         
+    def test_yield_many_deferreds(self):
+        
+        @twistit.yieldefer
+        def mock():
+            total = 0
+            for i in range(10000):
+                total += yield defer.succeed(i)
+            defer.returnValue(total)
+            
+        d = mock()
+        self.assertEqual(sum(range(10000)), extract_deferred(d))
+        
+    def test_yield_many_failures(self):
+        
+        @twistit.yieldefer
+        def mock():
+            count = 0
+            for i in range(10000):
+                try:
+                    yield defer.fail(ValueError())
+                except ValueError:
+                    count += 1
+            defer.returnValue(count)
+            
+        d = mock()
+        self.assertEqual(10000, extract_deferred(d))
+        
+    def test_yield_deferred_later(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def mock():
+            yield defer.succeed(41)
+            retval = yield blocking
+            defer.returnValue(retval)
+            
+        d = mock()
+        self.assertFalse(d.called)
+        blocking.callback(42)
+        self.assertEqual(42, extract_deferred(d))
+        
     def test_throw_first(self):
         @twistit.yieldefer
         def mock():
@@ -145,6 +195,21 @@ class TestYieldDefer(unittest.TestCase):
         d.cancel()
         self.assertEqual(42, extract_deferred(d))
         
+    def test_cancel_second(self):
+        first = defer.Deferred()
+        second = defer.Deferred()
+        
+        @twistit.yieldefer
+        def mock():
+            yield first
+            yield second
+            
+        d = mock()
+        first.callback(None)
+        d.cancel()
+        self.assertTrue(second.called)
+        self.assertRaises(defer.CancelledError, extract_deferred, d)
+        
     def test_cancel_errback(self):
         def canceller(d):
             try:
@@ -165,6 +230,90 @@ class TestYieldDefer(unittest.TestCase):
         
 
         
+    def test_cancel_handled(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def mock():
+            try:
+                yield blocking
+            except defer.CancelledError:
+                defer.returnValue("cleaned up")
+            
+        d = mock()
+        d.cancel()
+        self.assertEqual("cleaned up", extract_deferred(d))
+        
+    def test_cancel_ignored(self):
+        blocking = defer.Deferred()
+        later = defer.Deferred()
+        
+        @twistit.yieldefer
+        def mock():
+            try:
+                yield blocking
+            except defer.CancelledError:
+                pass
+            yield later
+            
+        d = mock()
+        d.cancel()
+        self.assertTrue(later.called)
+        self.assertRaises(defer.CancelledError, extract_deferred, d)
+        
+    def test_cancel_nested(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def inner():
+            yield blocking
+            
+        @twistit.yieldefer
+        def outer():
+            yield defer.succeed(None)
+            yield inner()
+            
+        d = outer()
+        d.cancel()
+        self.assertTrue(blocking.called)
+        self.assertRaises(defer.CancelledError, extract_deferred, d)
+        
+    def test_cancel_nested_handled(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def inner():
+            try:
+                yield blocking
+            except defer.CancelledError:
+                defer.returnValue("inner")
+            
+        @twistit.yieldefer
+        def outer():
+            retval = yield inner()
+            defer.returnValue("outer " + retval)
+            
+        d = outer()
+        d.cancel()
+        self.assertEqual("outer inner", extract_deferred(d))
+        
+    def test_cancel_nested_inner_finished(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def inner():
+            yield defer.succeed(None)
+            
+        @twistit.yieldefer
+        def outer():
+            yield inner()
+            yield blocking
+            
+        d = outer()
+        d.cancel()
+        self.assertTrue(blocking.called)
+        self.assertRaises(defer.CancelledError, extract_deferred, d)
+        
     def test_nested_in_traceback(self):
                 
         faild = defer.Deferred()
@@ -185,7 +334,7 @@ class TestYieldDefer(unittest.TestCase):
             faild.errback()
         
         failure = extract_failure(d)
-        sfile = stringio.StringIO()
+        sfile = StringIO()
         failure.printTraceback(file=sfile)
         info = sfile.getvalue()
         self.assertIn("func_h", info)
@@ -208,6 +357,381 @@ class TestYieldDefer(unittest.TestCase):
         
         d = f()
         self.assertRaises(ValueError, extract_deferred, d)
+        
+    def test_regular_function_generator(self):
+        
+        def gen():
+            retval = yield defer.succeed(42)
+            defer.returnValue(retval)
+        
+        @twistit.yieldefer
+        def f():
+            return gen()
+        
+        d = f()
+        self.assertEqual(42, extract_deferred(d))
+        
+
+class TestYieldStream(unittest.TestCase):
+    """
+    Unit tests for :func:`twistit.yieldstream`.
+    """
+    
+    def setUp(self):
+        self.produced = []
+        self.blocking = defer.Deferred()
+        
+        @twistit.yieldstream
+        def producer(count):
+            yield self.blocking
+            for i in range(count):
+                self.produced.append(i)
+                yield twistit.emit(i)
+        self.producer = producer
+        
+    def test_next(self):
+        stream = self.producer(2)
+        d = stream.next()
+        self.assertFalse(d.called)
+        self.blocking.callback(None)
+        self.assertEqual(0, extract_deferred(d))
+        self.assertEqual(1, extract_deferred(stream.next()))
+        self.assertRaises(twistit.EndOfStream, extract_deferred, stream.next())
+        self.assertRaises(twistit.EndOfStream, extract_deferred, stream.next())
+        
+    def test_flow_control(self):
+        stream = self.producer(10)
+        self.blocking.callback(None)
+        self.assertEqual([0], self.produced)
+        self.assertEqual(0, extract_deferred(stream.next()))
+        self.assertEqual([0, 1], self.produced)
+        
+    def test_buffer_size(self):
+        
+        @twistit.yieldstream(buffer_size=3)
+        def producer():
+            for i in range(10):
+                self.produced.append(i)
+                yield twistit.emit(i)
+            
+        stream = producer()
+        self.assertEqual([0, 1, 2], self.produced)
+        self.assertEqual(0, extract_deferred(stream.next()))
+        self.assertEqual([0, 1, 2, 3], self.produced)
+        
+    def test_failure(self):
+        
+        @twistit.yieldstream
+        def producer():
+            yield twistit.emit(1)
+            raise StubError()
+        
+        stream = producer()
+        self.assertEqual(1, extract_deferred(stream.next()))
+        self.assertRaises(StubError, extract_deferred, stream.next())
+        
+    def test_failure_waiting(self):
+        
+        @twistit.yieldstream
+        def producer():
+            yield self.blocking
+        
+        stream = producer()
+        d = stream.next()
+        self.blocking.errback(StubError())
+        self.assertRaises(StubError, extract_deferred, d)
+        
+    def test_cancel(self):
+        stream = self.producer(2)
+        d = stream.next()
+        stream.cancel()
+        self.assertTrue(self.blocking.called)
+        self.assertRaises(defer.CancelledError, extract_deferred, d)
+        
+    def test_cancel_paused(self):
+        stream = self.producer(10)
+        self.blocking.callback(None)
+        stream.cancel()
+        self.assertEqual(0, extract_deferred(stream.next()))
+        self.assertRaises(defer.CancelledError, extract_deferred, stream.next())
+        self.assertEqual([0], self.produced)
+        
+    def test_cancel_next(self):
+        stream = self.producer(2)
+        d = stream.next()
+        d.cancel()
+        self.blocking.callback(None)
+        self.assertRaises(defer.CancelledError, extract_deferred, d)
+        self.assertEqual(0, extract_deferred(stream.next()))
+        
+    def test_consume(self):
+        result = []
+        stream = self.producer(10)
+        d = stream.consume(result.append)
+        self.blocking.callback(None)
+        self.assertEqual(list(range(10)), result)
+        self.assertEqual(None, extract_deferred(d))
+        
+    def test_consume_waits(self):
+        pending = []
+        def callback(item):
+            pending.append(defer.Deferred())
+            return pending[-1]
+        
+        stream = self.producer(10)
+        d = stream.consume(callback)
+        self.blocking.callback(None)
+        self.assertEqual(1, len(pending))
+        self.assertEqual([0, 1], self.produced)
+        pending[0].callback(None)
+        self.assertEqual(2, len(pending))
+        self.assertFalse(d.called)
+        
+    def test_consume_fails(self):
+        def callback(item):
+            raise StubError()
+        
+        stream = self.producer(10)
+        d = stream.consume(callback)
+        self.blocking.callback(None)
+        self.assertRaises(StubError, extract_deferred, d)
+        self.assertEqual([0, 1], self.produced)
+        self.assertEqual(1, extract_deferred(stream.next()))
+        self.assertRaises(defer.CancelledError, extract_deferred, stream.next())
+        
+    def test_consume_cancelled(self):
+        stream = self.producer(10)
+        d = stream.consume(lambda item: None)
+        d.cancel()
+        self.assertTrue(self.blocking.called)
+        self.assertRaises(defer.CancelledError, extract_deferred, d)
+        self.assertRaises(defer.CancelledError, extract_deferred, stream.next())
+        
+    def test_positional_options(self):
+        self.assertRaises(TypeError, twistit.yieldstream, 3)
+        
+    def test_emit_outside_stream(self):
+        
+        @twistit.yieldefer
+        def function():
+            yield twistit.emit(1)
+        
+        self.assertRaises(TypeError, extract_deferred, function())
+        
+
+class TestProfiling(unittest.TestCase):
+    """
+    Unit tests for :func:`twistit.enable_profiling`.
+    """
+    
+    def setUp(self):
+        self.now = 0
+        twistit.enable_profiling(timer=lambda:self.now)
+        
+    def tearDown(self):
+        twistit.disable_profiling()
+        
+    def test_disabled(self):
+        twistit.disable_profiling()
+        
+        @twistit.yieldefer
+        def mock():
+            yield defer.succeed(None)
+            
+        mock()
+        self.assertEqual([], twistit.get_profile())
+        
+    def test_counts(self):
+        
+        @twistit.yieldefer
+        def mock(fail):
+            yield defer.succeed(None)
+            if fail:
+                raise StubError()
+            
+        mock(False)
+        mock(True).addErrback(lambda failure:None)
+        mock(False)
+        profile, = twistit.get_profile()
+        self.assertEqual("mock", profile.function.__name__)
+        self.assertEqual(3, profile.invocations)
+        self.assertEqual(2, profile.completions)
+        self.assertEqual(1, profile.failures)
+        
+    def test_times(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def mock():
+            self.now += 1
+            yield blocking
+            self.now += 2
+            
+        mock()
+        self.now += 10
+        blocking.callback(None)
+        
+        profile, = twistit.get_profile()
+        self.assertEqual(3, profile.active_time)
+        (filename, line), = profile.suspended.keys()
+        self.assertEqual(profile.function.__code__.co_filename, filename)
+        self.assertEqual((1, 10), profile.suspended[(filename, line)])
+        
+
+@unittest.skipIf(sys.version_info < (3, 5), "Requires Python 3.5")
+class TestYieldDeferPython3(unittest.TestCase):
+    """
+    Unit tests for :func:`twistit.yielddefer` with Python 3 features.
+    """
+    
+    def test_generator_return(self):
+        mock = define("""
+            @twistit.yieldefer
+            def mock():
+                retval = yield defer.succeed(42)
+                return retval
+            """)
+        d = mock()
+        self.assertEqual(42, extract_deferred(d))
+        
+    def test_async(self):
+        mock = define("""
+            @twistit.yieldefer
+            async def mock():
+                return 42
+            """)
+        d = mock()
+        self.assertEqual(42, extract_deferred(d))
+        
+    def test_async_await(self):
+        blocking = defer.Deferred()
+        mock = define("""
+            @twistit.yieldefer
+            async def mock():
+                first = await defer.succeed(1)
+                second = await blocking
+                return first + second
+            """, blocking=blocking)
+        d = mock()
+        self.assertFalse(d.called)
+        blocking.callback(41)
+        self.assertEqual(42, extract_deferred(d))
+        
+    def test_async_raise(self):
+        blocking = defer.Deferred()
+        mock = define("""
+            @twistit.yieldefer
+            async def mock():
+                try:
+                    await blocking
+                except StubError:
+                    return 42
+            """, blocking=blocking)
+        d = mock()
+        blocking.errback(StubError())
+        self.assertEqual(42, extract_deferred(d))
+        
+    def test_async_cancel(self):
+        blocking = defer.Deferred()
+        mock = define("""
+            @twistit.yieldefer
+            async def mock():
+                await blocking
+            """, blocking=blocking)
+        d = mock()
+        d.cancel()
+        self.assertTrue(blocking.called)
+        self.assertRaises(defer.CancelledError, extract_deferred, d)
+        
+    def test_async_stream(self):
+        blocking = defer.Deferred()
+        producer = define("""
+            @twistit.yieldstream
+            async def mock():
+                await blocking
+                for i in range(3):
+                    await twistit.emit(i)
+            """, blocking=blocking)
+        consumer = define("""
+            @twistit.yieldefer
+            async def mock(stream):
+                items = []
+                async for item in stream:
+                    items.append(item)
+                return items
+            """)
+        d = consumer(producer())
+        blocking.callback(None)
+        self.assertEqual([0, 1, 2], extract_deferred(d))
+        
+        
+
+@unittest.skipIf(contextvars is None, "Requires Python 3.7")
+class TestContextVariables(unittest.TestCase):
+    """
+    Unit tests for context propagation in :func:`twistit.yieldefer`.
+    """
+    
+    def setUp(self):
+        self.var = contextvars.ContextVar("var", default="default")
+        
+    def test_resumed_elsewhere(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def mock():
+            yield blocking
+            defer.returnValue(self.var.get())
+            
+        token = self.var.set("caller")
+        d = mock()
+        self.var.reset(token)
+        
+        blocking.callback(None)
+        self.assertEqual("caller", extract_deferred(d))
+        
+    def test_set_inside(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def mock():
+            self.var.set("inside")
+            yield blocking
+            defer.returnValue(self.var.get())
+            
+        d = mock()
+        self.assertEqual("default", self.var.get())
+        blocking.callback(None)
+        self.assertEqual("default", self.var.get())
+        self.assertEqual("inside", extract_deferred(d))
+        
+    def test_failure(self):
+        blocking = defer.Deferred()
+        
+        @twistit.yieldefer
+        def mock():
+            try:
+                yield blocking
+            except StubError:
+                defer.returnValue(self.var.get())
+            
+        token = self.var.set("caller")
+        d = mock()
+        self.var.reset(token)
+        
+        blocking.errback(StubError())
+        self.assertEqual("caller", extract_deferred(d))
+        
+        
+def define(source, **variables):
+    """
+    Returns the function defined in `source`. Syntax that
+    Python 2 cannot parse has to be hidden in a string.
+    """
+    namespace = dict(twistit=twistit, defer=defer, StubError=StubError)
+    namespace.update(variables)
+    exec(textwrap.dedent(source), namespace)
+    return namespace["mock"]
 
 
 class StubError(Exception):